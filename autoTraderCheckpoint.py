@@ -0,0 +1,130 @@
+import sqlite3
+import time
+import pandas as pd
+from autoTraderDedupe import listingFingerprints, NO_FINGERPRINT
+
+'''
+Append only checkpoint store for used car web scrape runs.
+
+Every make/model is written to a SQLite file as soon as it has been scraped: its formatted
+listings are appended to the listings table, any issues logged for it (failed pages or no
+data found) go in the issues table, and it is marked done in the manifest. All three are
+written in one transaction, so a crash part way through a make/model leaves no trace of it.
+
+Only the rows of the make/model just scraped are written, so the cost of a checkpoint stays
+the same however far through the run it is. A run started with --resume skips every make/model
+already in the manifest without issues, and scrapes only the ones that had issues, or were
+never reached, again.
+
+Each listing is stored with its fingerprint (see autoTraderDedupe.py), so listings repeated
+across make/models can be dropped as the output is written.
+'''
+
+CHECKPOINT_FILE = "usedCarScrapeCheckpoint.db"
+SQLITE_TIMEOUT = 60 # Seconds to wait on another process writing to the same file (see autoTraderWorkQueue.py)
+
+
+class CheckpointStore():
+
+        def __init__(self, path=CHECKPOINT_FILE):
+            self.path = path
+            self.connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT)
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS listings (makeModelIndex INTEGER, Make TEXT, Model TEXT, Name TEXT,
+                                                     Price REAL, Year INTEGER, Miles REAL, BHP REAL, L REAL,
+                                                     Trans TEXT, Fuel TEXT, Fingerprint INTEGER);
+                CREATE INDEX IF NOT EXISTS listingsMakeModel ON listings (makeModelIndex);
+                CREATE TABLE IF NOT EXISTS manifest (makeModelIndex INTEGER PRIMARY KEY, Make TEXT, Model TEXT,
+                                                     rowCount INTEGER, completedAt REAL);
+                CREATE TABLE IF NOT EXISTS issues (issue TEXT, makeModelIndex INTEGER, Make TEXT, Model TEXT);
+                CREATE INDEX IF NOT EXISTS issuesMakeModel ON issues (makeModelIndex);
+            """)
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(listings)")]
+            if 'Fingerprint' not in columns: # Checkpoint from before fingerprints were kept
+                self.connection.execute("ALTER TABLE listings ADD COLUMN Fingerprint INTEGER")
+
+
+        '''
+        Throw away everything checkpointed so far - for starting a run from scratch
+        '''
+        def clear(self):
+            with self.connection:
+                self.connection.execute("DELETE FROM listings")
+                self.connection.execute("DELETE FROM manifest")
+                self.connection.execute("DELETE FROM issues")
+
+
+        '''
+        Checkpoint one scraped make/model. dfIter is its formatted listings (None if nothing was
+        found) and issues its problem rows. Anything from an earlier attempt at the same
+        make/model is replaced.
+        '''
+        def saveMakeModel(self, makeModelIndex, make, model, dfIter, issues):
+            with self.connection:
+                self.writeMakeModel(makeModelIndex, make, model, dfIter, issues)
+
+
+        '''
+        saveMakeModel without its transaction - for callers writing more alongside it
+        '''
+        def writeMakeModel(self, makeModelIndex, make, model, dfIter, issues):
+            makeModelIndex = int(makeModelIndex)
+            rowCount = 0 if dfIter is None else dfIter.shape[0]
+            self.connection.execute("DELETE FROM listings WHERE makeModelIndex = ?", (makeModelIndex,))
+            self.connection.execute("DELETE FROM issues WHERE makeModelIndex = ?", (makeModelIndex,))
+            if rowCount > 0:
+                rows = dfIter[['Make', 'Model', 'Name', 'Price', 'Year', 'Miles', 'BHP', 'L', 'Trans', 'Fuel']]
+                fingerprints = listingFingerprints(dfIter).tolist()
+                self.connection.executemany("""INSERT INTO listings (makeModelIndex, Make, Model, Name, Price, Year, Miles,
+                                               BHP, L, Trans, Fuel, Fingerprint) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                                            [(makeModelIndex,) + tuple(self.toSqlite(value) for value in row) + (fingerprint,)
+                                             for row, fingerprint in zip(rows.itertuples(index=False), fingerprints)])
+            self.connection.executemany("INSERT INTO issues VALUES (?, ?, ?, ?)",
+                                        [(issue[0], makeModelIndex, issue[2], issue[3]) for issue in issues])
+            self.connection.execute("INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?, ?)",
+                                    (makeModelIndex, make, model, rowCount, time.time()))
+
+
+        '''
+        numpy scalars to plain Python values SQLite can store
+        '''
+        def toSqlite(self, value):
+            return value.item() if hasattr(value, 'item') else value
+
+
+        '''
+        Indexes (in the make and model pkl) of make/models that finished without any issues
+        '''
+        def completedIndexes(self):
+            rows = self.connection.execute("""SELECT makeModelIndex FROM manifest WHERE makeModelIndex NOT IN
+                                              (SELECT makeModelIndex FROM issues)""").fetchall()
+            return set(row[0] for row in rows)
+
+
+        def loadIssues(self):
+            rows = self.connection.execute("SELECT issue, makeModelIndex, Make, Model FROM issues ORDER BY rowid").fetchall()
+            return [list(row) for row in rows]
+
+
+        '''
+        All checkpointed listings in make and model order, formatted as dfGoodFormat leaves them
+        '''
+        def loadAll(self):
+            return pd.read_sql_query("""SELECT Make, Model, Name, Price, CAST(Year AS INTEGER) AS Year, Miles, BHP, L, Trans, Fuel
+                                        FROM listings ORDER BY makeModelIndex, rowid""", self.connection)
+
+
+        '''
+        loadAll batchSize listings at a time, as a generator - so the output can be written
+        without every listing in memory at once. With fingerprints each batch also has the
+        makeModelIndex and Fingerprint columns, for ListingDeduplicator.dedupeBatches.
+        '''
+        def iterBatches(self, batchSize, fingerprints=False):
+            extraColumns = ", makeModelIndex, COALESCE(Fingerprint, " + str(NO_FINGERPRINT) + ") AS Fingerprint" if fingerprints else ""
+            yield from pd.read_sql_query("""SELECT Make, Model, Name, Price, CAST(Year AS INTEGER) AS Year, Miles, BHP, L, Trans, Fuel""" + extraColumns + """
+                                           FROM listings ORDER BY makeModelIndex, rowid""", self.connection,
+                                         chunksize=batchSize)
+
+
+        def close(self):
+            self.connection.close()
@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import pandas as pd
+try:
+    import pyarrow as pa
+except ImportError: # pyarrow is optional - the dataset is then held in memory, once per process
+    pa = None
+from autoTraderOutputStore import readParquet, OUTPUT_COLUMNS
+from autoTraderQuery import ListingQuery
+
+'''
+Shared, read only access to the used car dataset for bokehServerAutoTrader.py.
+
+bokeh serve runs the app script again for every browser session, but modules it imports are
+only imported once per server process. So the dataset is opened here, once per process, and
+every session gets the same AutoTraderDataset from loadDataset rather than loading its own copy.
+
+The first time a data file is used it is converted to an Arrow IPC file next to it
+(DATA_FILE + ARROW_CACHE_SUFFIX): numeric columns as float64, sorted by make and model, with
+the row range of every make/model and the model order for the drop downs stored in its
+metadata. After that, opening the dataset memory maps the Arrow file - nothing is read until
+a make/model's rows are asked for, and then only those rows. Several server processes
+mapping the same file share its pages, so memory per process and per session no longer
+grows with the size of the dataset. The Arrow file is rebuilt if the data file is newer.
+
+Without pyarrow the data file is loaded into memory instead, still only once per process.
+
+The data file can also be the SQLite output (usedCarAutoTraderOutput.db). Nothing is loaded
+up front then - each make/model's rows are an indexed query (see autoTraderQuery.py).
+'''
+
+ARROW_CACHE_SUFFIX = ".arrow"
+NUMERIC_COLUMNS = ['Price', 'Year', 'Miles', 'BHP', 'L']
+
+# Every dataset opened in this process, by data file path - shared by every session
+datasets = {}
+datasetsLock = threading.Lock()
+
+
+'''
+The dataset for a data file (pkl, Parquet directory or SQLite output), opened on first use in
+this process
+'''
+def loadDataset(path):
+    with datasetsLock:
+        if path not in datasets:
+            datasets[path] = AutoTraderDataset(path)
+        return datasets[path]
+
+
+def readDataFile(path):
+    if path.endswith(".parquet"):
+        return readParquet(path)
+    return pd.read_pickle(path)
+
+
+'''
+The data file made ready for plotting - numeric columns as float, one contiguous block of
+rows per make/model. Also returns each make's models in the order they first appear in the
+data file, and the (make, model, start, stop) rows of every make/model.
+'''
+def prepareDataFrame(dfOnline):
+    dfOnline = dfOnline.copy()
+    for column in ['Make', 'Model']:
+        dfOnline[column] = dfOnline[column].astype(str)
+    for column in NUMERIC_COLUMNS:
+        dfOnline[column] = dfOnline[column].astype(float)
+
+    makeModelDict = dfOnline.groupby('Make')['Model'].apply(list).to_dict()
+    makeModels = {k: sorted(set(j), key=j.index) for k, j in makeModelDict.items()}
+
+    dfOnline = dfOnline.sort_values(['Make', 'Model'], kind='stable').reset_index(drop=True)
+    blocks = dfOnline.groupby(['Make', 'Model'], sort=False).size()
+    slices = []
+    start = 0
+    for (make, model), rowCount in blocks.items():
+        slices.append([make, model, start, start + int(rowCount)])
+        start = start + int(rowCount)
+    return dfOnline, makeModels, slices
+
+
+'''
+Convert a data file to the Arrow IPC file opened by AutoTraderDataset. Written to a temporary
+file first, so a server process never maps a half written file.
+'''
+def writeArrowCache(dataPath, arrowPath):
+    dfOnline, makeModels, slices = prepareDataFrame(readDataFile(dataPath))
+    table = pa.Table.from_pandas(dfOnline, preserve_index=False).combine_chunks()
+    table = table.replace_schema_metadata({'makeModels': json.dumps(makeModels),
+                                           'makeModelSlices': json.dumps(slices)})
+    tempPath = arrowPath + "." + str(os.getpid()) + ".tmp"
+    with pa.OSFile(tempPath, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tempPath, arrowPath)
+
+
+class AutoTraderDataset():
+
+        def __init__(self, path):
+            self.path = path
+            self.query = None
+            if path.endswith(".db"):
+                self.query = ListingQuery(path)
+                self.table = None
+                self.frame = None
+                self.makeModels = self.query.makeModels()
+                slices = []
+                self.columns = sorted(OUTPUT_COLUMNS)
+                self.discrete = [x for x in self.columns if x not in NUMERIC_COLUMNS]
+            elif pa is not None:
+                arrowPath = path + ARROW_CACHE_SUFFIX
+                if not os.path.exists(arrowPath) or os.path.getmtime(arrowPath) < os.path.getmtime(path):
+                    writeArrowCache(path, arrowPath)
+                self.table = pa.ipc.open_file(pa.memory_map(arrowPath, 'r')).read_all() # Zero copy - pages load on use
+                self.frame = None
+                metadata = self.table.schema.metadata
+                self.makeModels = json.loads(metadata[b'makeModels'])
+                slices = json.loads(metadata[b'makeModelSlices'])
+                self.columns = sorted(self.table.column_names)
+                self.discrete = [x for x in self.columns if not pa.types.is_floating(self.table.schema.field(x).type)]
+            else:
+                self.table = None
+                self.frame, self.makeModels, slices = prepareDataFrame(readDataFile(path))
+                self.columns = sorted(self.frame.columns)
+                self.discrete = [x for x in self.columns if not pd.api.types.is_numeric_dtype(self.frame[x])]
+            self.makes = sorted(self.makeModels)
+            self.makeModelSlices = {(make, model): (start, stop) for make, model, start, stop in slices}
+
+
+        '''
+        df of one make/model's rows - only these rows are read from the Arrow file or SQLite output
+        '''
+        def rows(self, make, model):
+            if self.query is not None:
+                return self.query.rows(Make=make, Model=model)
+            start, stop = self.makeModelSlices.get((make, model), (0, 0))
+            if self.table is not None:
+                return self.table.slice(start, stop - start).to_pandas()
+            return self.frame.iloc[start:stop]
@@ -0,0 +1,218 @@
+import hashlib
+import logging
+import os
+import time
+import numpy as np
+import pandas as pd
+from autoTraderMetrics import metrics
+
+'''
+Run wide deduplication of the used car listings.
+
+dfGoodFormat drops rows repeated within one make/model's search results, but promoted and
+featured adverts also turn up in the searches of other make/models. Every listing is given
+a 64 bit fingerprint - a blake2b hash of its advert ID, or of its name, price, miles and year
+if its card had no link - and the first make/model a fingerprint is seen for owns it. Rows of
+any other make/model with the same fingerprint are dropped as duplicates.
+
+FingerprintIndex holds the fingerprints and their owners in sorted numpy arrays, 12 bytes
+per listing, rather than a Python set (around ten times that). It is exact - a Bloom filter
+would be smaller still, but every false positive would drop a real listing. The index can be
+saved and loaded (DEDUPE_INDEX_FILE), so the incremental re-scrape keeps which make/model
+owns each listing between runs.
+
+How many listings of each make/model were dropped is written to DUPLICATES_FILE.
+'''
+
+DEDUPE_INDEX_FILE = "usedCarSeenListings.npz"
+DUPLICATES_FILE = "usedCarDuplicateRates.csv"
+NO_FINGERPRINT = 0 # Rows checkpointed without a fingerprint - never treated as duplicates
+NO_OWNER = -1
+MERGE_MIN = 65536 # Fingerprints added before they are merged into the main sorted array
+
+logger = logging.getLogger(__name__)
+
+
+'''
+64 bit fingerprint of one listing, as a signed int so SQLite can store it
+'''
+def fingerprint(advertId, name, price, miles, year):
+    if advertId is None or advertId != advertId: # NAN never equals itself
+        text = "listing:" + "\x1f".join(str(value) for value in (name, price, miles, year))
+    else:
+        text = "id:" + str(advertId)
+    value = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+    return value if value != NO_FINGERPRINT else 1
+
+
+'''
+Fingerprints of every listing of a formatted df, as an int64 array. Advert IDs are taken
+from the index when it is the AdvertId index dfGoodFormat leaves.
+'''
+def listingFingerprints(dfIter):
+    advertIds = dfIter.index if dfIter.index.name == 'AdvertId' else [None] * dfIter.shape[0]
+    rows = dfIter[['Name', 'Price', 'Miles', 'Year']].itertuples(index=False)
+    return np.array([fingerprint(advertId, *row) for advertId, row in zip(advertIds, rows)], dtype=np.int64)
+
+
+class FingerprintIndex():
+
+        def __init__(self):
+            self.fingerprints = np.empty(0, dtype=np.int64) # Sorted
+            self.owners = np.empty(0, dtype=np.int32)
+            self.pending = [] # Sorted (fingerprints, owners) chunks added since the last merge
+            self.pendingCount = 0
+
+
+        def __len__(self):
+            return self.fingerprints.shape[0] + self.pendingCount
+
+
+        def nbytes(self):
+            return (self.fingerprints.nbytes + self.owners.nbytes +
+                    sum(fingerprints.nbytes + owners.nbytes for fingerprints, owners in self.pending))
+
+
+        '''
+        Owner of each fingerprint, NO_OWNER for ones not in the index
+        '''
+        def lookup(self, fingerprints):
+            owners = np.full(fingerprints.shape[0], NO_OWNER, dtype=np.int64)
+            for keys, keyOwners in [(self.fingerprints, self.owners)] + self.pending:
+                if keys.shape[0] == 0:
+                    continue
+                positions = np.minimum(np.searchsorted(keys, fingerprints), keys.shape[0] - 1)
+                found = keys[positions] == fingerprints
+                owners[found] = keyOwners[positions[found]]
+            return owners
+
+
+        '''
+        Claim every fingerprint not already in the index for the owner of its row - the first
+        row's, where one repeats. Returns which rows to keep: those whose fingerprint is owned by
+        their own owner.
+        '''
+        def claim(self, fingerprints, owners):
+            known = self.lookup(fingerprints)
+            unknown = (known == NO_OWNER) & (fingerprints != NO_FINGERPRINT)
+            if unknown.any():
+                newFingerprints, first = np.unique(fingerprints[unknown], return_index=True)
+                self.pending.append((newFingerprints, owners[unknown][first].astype(np.int32)))
+                self.pendingCount = self.pendingCount + newFingerprints.shape[0]
+                known[unknown] = self.lookup(fingerprints[unknown])
+                if self.pendingCount >= max(MERGE_MIN, self.fingerprints.shape[0] // 4):
+                    self.merge()
+            return (known == owners) | (fingerprints == NO_FINGERPRINT)
+
+
+        '''
+        Forget fingerprints, e.g. of listings that have been taken down
+        '''
+        def discard(self, fingerprints):
+            self.merge()
+            keep = ~np.isin(self.fingerprints, fingerprints)
+            self.fingerprints = self.fingerprints[keep]
+            self.owners = self.owners[keep]
+
+
+        def merge(self):
+            if not self.pending:
+                return
+            fingerprints = np.concatenate([self.fingerprints] + [keys for keys, keyOwners in self.pending])
+            owners = np.concatenate([self.owners] + [keyOwners for keys, keyOwners in self.pending])
+            order = np.argsort(fingerprints, kind='stable')
+            self.fingerprints = fingerprints[order]
+            self.owners = owners[order]
+            self.pending = []
+            self.pendingCount = 0
+
+
+        def save(self, path=DEDUPE_INDEX_FILE):
+            self.merge()
+            tempPath = path + ".tmp"
+            with open(tempPath, 'wb') as f:
+                np.savez(f, fingerprints=self.fingerprints, owners=self.owners)
+            os.replace(tempPath, path)
+
+
+        '''
+        The index saved at path, or an empty one if nothing has been saved there yet
+        '''
+        @classmethod
+        def load(cls, path=DEDUPE_INDEX_FILE):
+            index = cls()
+            if os.path.exists(path):
+                with np.load(path) as saved:
+                    index.fingerprints = saved['fingerprints']
+                    index.owners = saved['owners']
+            return index
+
+
+class ListingDeduplicator():
+
+        def __init__(self, index=None):
+            self.index = index if index is not None else FingerprintIndex()
+            self.counts = {} # (Make, Model) to [listings, duplicates]
+
+
+        '''
+        One make/model's formatted listings without the ones another make/model owns
+        '''
+        def dedupe(self, dfIter, makeModelIndex):
+            if dfIter is None or dfIter.shape[0] == 0:
+                return dfIter
+            start = time.perf_counter()
+            fingerprints = listingFingerprints(dfIter)
+            keep = self.index.claim(fingerprints, np.full(fingerprints.shape[0], int(makeModelIndex), dtype=np.int64))
+            self.record(dfIter['Make'], dfIter['Model'], keep)
+            metrics.observe("dedupe_seconds", time.perf_counter() - start)
+            return dfIter[keep]
+
+
+        '''
+        Generator of batches as checkpointed with fingerprints (see CheckpointStore.iterBatches)
+        without the duplicates, or their makeModelIndex and Fingerprint columns. The batches
+        must be in make/model order for the first make/model to keep each listing.
+        '''
+        def dedupeBatches(self, batches):
+            for dfBatch in batches:
+                start = time.perf_counter()
+                keep = self.index.claim(dfBatch['Fingerprint'].to_numpy(dtype=np.int64),
+                                        dfBatch['makeModelIndex'].to_numpy(dtype=np.int64))
+                self.record(dfBatch['Make'], dfBatch['Model'], keep)
+                metrics.observe("dedupe_seconds", time.perf_counter() - start)
+                yield dfBatch[keep].drop(columns=['makeModelIndex', 'Fingerprint'])
+
+
+        def record(self, makes, models, keep):
+            dropped = int((~keep).sum())
+            metrics.count("listings_dropped_total", dropped, reason="cross_model_duplicate")
+            dfCounts = pd.DataFrame({'Make': makes.to_numpy(), 'Model': models.to_numpy(), 'Duplicate': ~keep})
+            for (make, model), duplicates in dfCounts.groupby(['Make', 'Model'], sort=False)['Duplicate']:
+                counts = self.counts.setdefault((make, model), [0, 0])
+                counts[0] = counts[0] + duplicates.shape[0]
+                counts[1] = counts[1] + int(duplicates.sum())
+
+
+        '''
+        Listings and duplicates dropped of every make/model, highest duplicate rate first
+        '''
+        def duplicateRates(self):
+            dfRates = pd.DataFrame([[make, model, listings, duplicates]
+                                    for (make, model), (listings, duplicates) in self.counts.items()],
+                                   columns=['Make', 'Model', 'Listings', 'Duplicates'])
+            dfRates['DuplicateRate'] = dfRates['Duplicates'] / dfRates['Listings']
+            return dfRates.sort_values('DuplicateRate', ascending=False, kind='stable').reset_index(drop=True)
+
+
+        def writeReport(self, path=DUPLICATES_FILE):
+            self.duplicateRates().to_csv(path, index=False)
+
+
+        def logStats(self):
+            listings = sum(listings for listings, duplicates in self.counts.values())
+            duplicates = sum(duplicates for listings, duplicates in self.counts.values())
+            if listings:
+                logger.info("Cross model duplicates dropped: %d of %d listings (%.1f%%), %d fingerprints in %.1f MB - see %s",
+                            duplicates, listings, 100.0 * duplicates / listings, len(self.index),
+                            self.index.nbytes() / 1e6, DUPLICATES_FILE)
@@ -0,0 +1,312 @@
+import argparse
+import hashlib
+import logging
+import sqlite3
+import time
+import pandas as pd
+from autoTraderUsedCarScrape import (AutoTraderUsedCarScraper, PROXIES, PKL_READ_FILE, PKL_OUT_FILE,
+                                     MAX_PAGE_NUM, LISTING_COLUMNS, OUTPUT_SINKS, RESPONSE_CACHE, DEDUPE_LISTINGS)
+from autoTraderOutputStore import openSinks, writeOutput, OUTPUT_BATCH_SIZE
+from autoTraderDedupe import (ListingDeduplicator, FingerprintIndex, fingerprint, listingFingerprints, DEDUPE_INDEX_FILE,
+                              NO_OWNER)
+from autoTraderMetrics import metrics, configureLogging, startMetricsServer, stopMetricsServer, LOG_LEVEL
+
+'''
+Incremental re-scrape of the used car listings - only new and changed listings are fetched.
+
+A local index (LISTING_INDEX_FILE) holds every listing found so far, keyed by the advert ID on
+its listing card, along with a hash of its contents. Each make/model is searched newest advert
+first (sort=datedesc) and pages are requested a batch at a time as usual, but once a page comes
+back with nothing that isn't already in the index, with the same contents, no more pages are
+requested. The listings that were fetched are compared against the index and only the changes
+are applied and written out to CHANGES_FILE:
+
+    insert - advert ID not in the index
+    update - advert ID in the index, but its price/name/specs have changed
+    remove - advert ID in the index, but no longer listed for its make/model
+
+The full dataset is then written from the index to the same output files (pkl, csv and Parquet)
+in the same format as performUsedCarWebScrape in autoTraderUsedCarScrape.py.
+
+With DEDUPE_LISTINGS a listing is only indexed for the first make/model it was found for, and
+dropped from the results of any other (see autoTraderDedupe.py). Which make/model owns each
+listing is kept in DEDUPE_INDEX_FILE between runs, so a featured advert doesn't move between
+make/models, showing up as an insert each time, from one run to the next.
+
+Limits of stopping at already seen listings:
+    - A removal can only be spotted when every page of a make/model was fetched, as a listing
+      that wasn't fetched may just be on a page further down. So removals are only emitted
+      for make/models where no pages were skipped - ones that ran out of results, e.g. with
+      only a page or two, or where all MAX_PAGE_NUM pages were fetched without stopping early.
+    - An older advert whose price is cut keeps its place in a date sorted search, so the update
+      is only picked up if it is on a page that was fetched.
+    - Listings found by the search but not on the first MAX_PAGE_NUM pages are never indexed,
+      as in the full scrape - though which listings these are differs as the sort differs.
+Run with --full now and then to fetch every page and catch up on these.
+
+The issues of each make/model (failed or blocked pages, no listings found) are kept in the
+index alongside its listings, replaced every time it is re-scraped, as the full scrape keeps
+them in its checkpoint store.
+'''
+
+LISTING_INDEX_FILE = "usedCarListingIndex.db"
+CHANGES_FILE = "usedCarAutoTraderChanges.csv"
+DATE_SORT = "datedesc" # Newest adverts first
+METRICS_JSON_FILE = "usedCarIncrementalMetrics.json" # Timings and counts of the run, kept apart from the full scrape's
+
+logger = logging.getLogger(__name__)
+
+
+'''
+Hash of a listing's formatted values, to spot when a listing has changed between scrapes.
+Whole numbers are hashed as floats, as Year was before it became an int, so the hashes in
+listing indexes from earlier runs still match.
+'''
+def listingHash(values):
+    text = "\x1f".join(repr(float(value)) if isinstance(value, int) else repr(value) for value in values)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+'''
+What a listing is known by in the index - its advert ID, or its contents if the card had no link
+'''
+def listingKey(advertId, contentHash):
+    if advertId is None or advertId != advertId: # NAN never equals itself
+        return "content:" + contentHash
+    return str(advertId)
+
+
+class ListingIndex():
+
+        def __init__(self, path=LISTING_INDEX_FILE):
+            self.path = path
+            self.connection = sqlite3.connect(path)
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS listings (listingKey TEXT PRIMARY KEY, makeModelIndex INTEGER,
+                                                     Make TEXT, Model TEXT, Name TEXT, Price REAL, Year INTEGER,
+                                                     Miles REAL, BHP REAL, L REAL, Trans TEXT, Fuel TEXT,
+                                                     contentHash TEXT, firstSeen REAL, lastSeen REAL);
+                CREATE INDEX IF NOT EXISTS listingsMakeModel ON listings (makeModelIndex);
+                CREATE TABLE IF NOT EXISTS issues (issue TEXT, makeModelIndex INTEGER, Make TEXT, Model TEXT);
+                CREATE INDEX IF NOT EXISTS issuesMakeModel ON issues (makeModelIndex);
+            """)
+
+
+        '''
+        Listing key to content hash of every listing indexed for one make/model
+        '''
+        def knownListings(self, makeModelIndex):
+            rows = self.connection.execute("SELECT listingKey, contentHash FROM listings WHERE makeModelIndex = ?",
+                                           (int(makeModelIndex),)).fetchall()
+            return dict(rows)
+
+
+        '''
+        Apply the changes found for one make/model in one transaction. inserts and updates are
+        (listingKey, values, contentHash) with values in LISTING_COLUMNS order, unchanged and
+        removals are listing keys. issues replace the make/model's issues from earlier runs.
+        Returns the removed listings' rows for the changes file.
+        '''
+        def applyChanges(self, makeModelIndex, make, model, inserts, updates, unchanged, removals, issues):
+            makeModelIndex = int(makeModelIndex)
+            now = time.time()
+            with self.connection:
+                removed = []
+                for key in removals:
+                    removed.extend(self.connection.execute("""SELECT listingKey, Make, Model, Name, Price, CAST(Year AS INTEGER), Miles,
+                                                              BHP, L, Trans, Fuel FROM listings WHERE listingKey = ?""",
+                                                           (key,)).fetchall())
+                self.connection.executemany("DELETE FROM listings WHERE listingKey = ?", [(key,) for key in removals])
+                self.connection.executemany("INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                            [(key, makeModelIndex, make, model) + values + (contentHash, now, now)
+                                             for key, values, contentHash in inserts])
+                self.connection.executemany("""UPDATE listings SET Name = ?, Price = ?, Year = ?, Miles = ?, BHP = ?, L = ?,
+                                               Trans = ?, Fuel = ?, contentHash = ?, lastSeen = ? WHERE listingKey = ?""",
+                                            [values + (contentHash, now, key) for key, values, contentHash in updates])
+                self.connection.executemany("UPDATE listings SET lastSeen = ? WHERE listingKey = ?",
+                                            [(now, key) for key in unchanged])
+                self.connection.execute("DELETE FROM issues WHERE makeModelIndex = ?", (makeModelIndex,))
+                self.connection.executemany("INSERT INTO issues VALUES (?, ?, ?, ?)",
+                                            [(issue[0], makeModelIndex, issue[2], issue[3]) for issue in issues])
+            return removed
+
+
+        def loadIssues(self):
+            rows = self.connection.execute("SELECT issue, makeModelIndex, Make, Model FROM issues ORDER BY rowid").fetchall()
+            return [list(row) for row in rows]
+
+
+        '''
+        Every indexed listing in make and model order, formatted as dfGoodFormat leaves them
+        '''
+        def loadAll(self):
+            dfAllData = pd.read_sql_query("""SELECT Make, Model, Name, Price, CAST(Year AS INTEGER) AS Year, Miles, BHP, L, Trans, Fuel
+                                             FROM listings ORDER BY makeModelIndex, firstSeen, rowid""", self.connection)
+            # Listings with different advert IDs but the same details are dropped, as dfGoodFormat does
+            return dfAllData.drop_duplicates(keep='first').reset_index(drop=True)
+
+
+        '''
+        loadAll about batchSize listings at a time, as a generator. A make/model's listings
+        are never split between batches, so its duplicates can still be dropped.
+        '''
+        def iterBatches(self, batchSize):
+            dfCarried = None # Listings of the last make/model of a batch - it may carry on in the next
+            for dfBatch in pd.read_sql_query("""SELECT makeModelIndex, Make, Model, Name, Price, CAST(Year AS INTEGER) AS Year, Miles, BHP, L, Trans, Fuel
+                                               FROM listings ORDER BY makeModelIndex, firstSeen, rowid""", self.connection,
+                                             chunksize=batchSize):
+                if dfCarried is not None:
+                    dfBatch = pd.concat([dfCarried, dfBatch], ignore_index=True)
+                lastMakeModel = dfBatch['makeModelIndex'].iloc[-1]
+                dfCarried = dfBatch[dfBatch['makeModelIndex'] == lastMakeModel]
+                dfBatch = dfBatch[dfBatch['makeModelIndex'] != lastMakeModel]
+                if dfBatch.shape[0] > 0:
+                    yield dfBatch.drop(columns='makeModelIndex').drop_duplicates(keep='first')
+            if dfCarried is not None:
+                yield dfCarried.drop(columns='makeModelIndex').drop_duplicates(keep='first')
+
+
+        def close(self):
+            self.connection.close()
+
+
+'''
+Formatted listings of one make/model as (listingKey, values, contentHash), the first of
+any listing that turns up more than once
+'''
+def keyListings(dfIter):
+    listings = []
+    keys = set()
+    for advertId, row in zip(dfIter.index, dfIter[LISTING_COLUMNS].itertuples(index=False)):
+        values = tuple(value.item() if hasattr(value, 'item') else value for value in row) # numpy to Python
+        contentHash = listingHash(values)
+        key = listingKey(advertId, contentHash)
+        if key not in keys:
+            keys.add(key)
+            listings.append((key, values, contentHash))
+    return listings
+
+
+'''
+Fingerprint of a listing removed from the index, from its row as applyChanges returns it
+'''
+def removedFingerprint(row):
+    key, make, model, name, price, year, miles = row[:7]
+    return fingerprint(None if key.startswith("content:") else key, name, price, miles, year)
+
+
+'''
+stopPaging callback for scrapePage - True once a page has no listings that aren't already
+indexed with the same contents. With a deduplicator, listings another make/model owns are
+passed over, as they are never indexed for this one.
+'''
+def makeSeenPageCheck(webScraper, known, deduplicator=None, makeModelIndex=None):
+    def seenPage(pageColumns):
+        dfPage = webScraper.extractAttributes([pageColumns]).dropna() # As dfGoodFormat drops them
+        if deduplicator is not None and dfPage.shape[0] > 0:
+            owners = deduplicator.index.lookup(listingFingerprints(dfPage))
+            dfPage = dfPage[(owners == NO_OWNER) | (owners == makeModelIndex)]
+        return all(known.get(key) == contentHash for key, values, contentHash in keyListings(dfPage))
+    return seenPage
+
+
+'''
+Re-scrape every make and model, fetching only as far as the listings already indexed and
+writing out just the inserts, updates and removals. With full every page is fetched, as
+a full scrape does, so every update and removal is caught.
+'''
+def performIncrementalWebScrape(full=False):
+    metrics.reset()
+    metricsServer = startMetricsServer()
+    webScraper = AutoTraderUsedCarScraper(PROXIES, PKL_READ_FILE, PKL_OUT_FILE)
+    webScraper.startParsePipeline()
+    if RESPONSE_CACHE:
+        webScraper.openResponseCache()
+    dfMakeModel = pd.read_pickle(PKL_READ_FILE)
+    listingIndex = ListingIndex(LISTING_INDEX_FILE)
+    deduplicator = ListingDeduplicator(FingerprintIndex.load(DEDUPE_INDEX_FILE)) if DEDUPE_LISTINGS else None
+    removedFingerprints = []
+    changes = []
+
+    for makeModel in dfMakeModel.iterrows(): # iterate through all makes and models
+        make = makeModel[1].iloc[0]
+        model = makeModel[1].iloc[1]
+        logger.info("You have started to re-scrape the: %s %s", make, model)
+        start = time.perf_counter()
+
+        known = listingIndex.knownListings(makeModel[0])
+        webpageSet = webScraper.urlPages(webScraper.urlModelCreate(make, model, sort=DATE_SORT), MAX_PAGE_NUM)
+        stopPaging = None if full else makeSeenPageCheck(webScraper, known, deduplicator, makeModel[0])
+        pageSet, failedRequests = webScraper.scrapePage(webpageSet, makeModel, make, model, stopPaging=stopPaging)
+        issues = list(failedRequests)
+
+        with metrics.timer("extract_seconds"):
+            dfIter = webScraper.extractAttributes(pageSet)
+        if dfIter.shape[0] != 0:
+            dfIter = webScraper.dfGoodFormat(dfIter, make, model)
+        if dfIter.shape[0] == 0 and not failedRequests: # As scrapeMakeModel logs it
+            issues.append(["No Data Found", makeModel[0], make, model])
+        if deduplicator is not None and dfIter.shape[0] != 0:
+            dfIter = deduplicator.dedupe(dfIter, makeModel[0])
+
+        inserts = []
+        updates = []
+        unchanged = []
+        for key, values, contentHash in keyListings(dfIter):
+            if key not in known:
+                inserts.append((key, values, contentHash))
+            elif known[key] != contentHash:
+                updates.append((key, values, contentHash))
+            else:
+                unchanged.append(key)
+
+        # Only safe to say a listing has gone if every page was fetched
+        removals = []
+        if webScraper.reachedLastPage:
+            fetched = set(key for key, values, contentHash in inserts + updates) | set(unchanged)
+            removals = [key for key in known if key not in fetched]
+
+        removed = listingIndex.applyChanges(makeModel[0], make, model, inserts, updates, unchanged, removals, issues)
+        changes.extend(["insert", key, make, model] + list(values) for key, values, contentHash in inserts)
+        changes.extend(["update", key, make, model] + list(values) for key, values, contentHash in updates)
+        changes.extend(["remove"] + list(row) for row in removed)
+        removedFingerprints.extend(removedFingerprint(row) for row in removed)
+        logger.info("%d new, %d updated, %d removed listings", len(inserts), len(updates), len(removed))
+        metrics.observe("makemodel_seconds", time.perf_counter() - start)
+        metrics.count("makemodels_total")
+        metrics.count("listings_total", dfIter.shape[0])
+
+    dfChanges = pd.DataFrame(changes, columns=['Change', 'AdvertId', 'Make', 'Model'] + LISTING_COLUMNS)
+    dfChanges.to_csv(CHANGES_FILE)
+    writeOutput(listingIndex.iterBatches(OUTPUT_BATCH_SIZE), openSinks(OUTPUT_SINKS, PKL_OUT_FILE))
+    issues = listingIndex.loadIssues()
+    listingIndex.close()
+    if deduplicator is not None:
+        # Listings taken down can be claimed again, e.g. if readvertised under another make/model
+        deduplicator.index.discard(removedFingerprints)
+        deduplicator.index.save(DEDUPE_INDEX_FILE)
+        deduplicator.writeReport()
+    webScraper.session.close()
+    webScraper.stopParsePipeline()
+    webScraper.closeResponseCache()
+
+    logger.info("%d changes written to %s, %d issues logged", dfChanges.shape[0], CHANGES_FILE, len(issues))
+    logger.info("Pages requested: %d, requests saved: %d", webScraper.pagesRequested, webScraper.pagesSkipped)
+    webScraper.session.logBlockStats()
+    if webScraper.proxyPool is not None:
+        webScraper.proxyPool.logStats()
+    if deduplicator is not None:
+        deduplicator.logStats()
+    metrics.writeReport(METRICS_JSON_FILE, run="incremental", full=full, issues=len(issues), changes=int(dfChanges.shape[0]))
+    stopMetricsServer(metricsServer)
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Re-scrape AutoTrader fetching only new and changed used car listings")
+    argParser.add_argument("--full", action="store_true",
+                           help="fetch every page of every make/model, to catch all updates and removals")
+    argParser.add_argument("--log-level", default=LOG_LEVEL, choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                           help="DEBUG also logs every page (default " + LOG_LEVEL + ")")
+    args = argParser.parse_args()
+    configureLogging(args.log_level)
+    performIncrementalWebScrape(full=args.full)
@@ -0,0 +1,87 @@
+import numpy as np
+
+'''
+Level of detail for plotting large make/model selections in bokehServerAutoTrader.py.
+
+Sending every listing of a popular model as its own circle, with its own hover text, makes
+the payload and the browser's render time grow with the number of listings. Instead, when
+more than LOD_THRESHOLD points are in view they are binned into a 2D histogram on the
+chosen x/y and only the non-empty bins are sent, drawn as shaded rectangles. Zooming in
+far enough that LOD_THRESHOLD points or fewer are in view sends the raw points in view.
+
+So at most LOD_THRESHOLD points or LOD_BINS[0] * LOD_BINS[1] bins are ever sent. Discrete
+axes can't be binned this way, so there the points are thinned to at most MAX_POINTS.
+'''
+
+LOD_THRESHOLD = 5000 # Most points shown as individual circles - above this a density is shown
+LOD_BINS = (60, 40) # Number of x and y bins in the density view
+MAX_POINTS = 20000 # Cap on points sent when an axis is discrete and can't be binned
+DENSITY_COLUMNS = ['x', 'y', 'width', 'height', 'count', 'alpha']
+
+
+'''
+(xStart, xEnd, yStart, yEnd) covering every point
+'''
+def dataWindow(xs, ys):
+    return (xs.min(), xs.max(), ys.min(), ys.max())
+
+
+def inWindow(xs, ys, window):
+    xStart, xEnd, yStart, yEnd = window
+    return (xs >= xStart) & (xs <= xEnd) & (ys >= yStart) & (ys <= yEnd)
+
+
+def emptyDensity():
+    return {column: np.array([]) for column in DENSITY_COLUMNS}
+
+
+'''
+2D histogram of the points within window. Returns the centre, size and count of each
+non-empty bin, with an alpha for shading it by how many listings it holds.
+'''
+def binDensity(xs, ys, window, bins=LOD_BINS):
+    xStart, xEnd, yStart, yEnd = window
+    if xEnd <= xStart: # Every point has the same value - give the bins some width
+        xStart, xEnd = xStart - 0.5, xEnd + 0.5
+    if yEnd <= yStart:
+        yStart, yEnd = yStart - 0.5, yEnd + 0.5
+    counts, xEdges, yEdges = np.histogram2d(xs, ys, bins=bins, range=[[xStart, xEnd], [yStart, yEnd]])
+    xIndex, yIndex = np.nonzero(counts)
+    count = counts[xIndex, yIndex]
+    if len(count) == 0:
+        return emptyDensity()
+    return dict(x=(xEdges[xIndex] + xEdges[xIndex + 1]) / 2,
+                y=(yEdges[yIndex] + yEdges[yIndex + 1]) / 2,
+                width=np.full(len(count), xEdges[1] - xEdges[0]),
+                height=np.full(len(count), yEdges[1] - yEdges[0]),
+                count=count.astype(np.int64),
+                alpha=0.2 + 0.8 * count / count.max())
+
+
+'''
+What to send for the points in data (the plot's data source columns) when window is in
+view - None for everything. Returns (points, density): the data source columns of the
+points to draw and the bins to draw, one of which is empty.
+'''
+def levelOfDetail(data, window=None, discreteAxes=False, threshold=LOD_THRESHOLD, bins=LOD_BINS, maxPoints=MAX_POINTS):
+    pointCount = len(data['x'])
+    if discreteAxes:
+        if pointCount <= maxPoints:
+            return dict(data), emptyDensity()
+        keep = np.arange(0, pointCount, -(-pointCount // maxPoints)) # Every nth point
+        return {column: values[keep] for column, values in data.items()}, emptyDensity()
+
+    xs = data['x']
+    ys = data['y']
+    if window is None:
+        if pointCount <= threshold:
+            return dict(data), emptyDensity()
+        window = dataWindow(xs, ys)
+        visible = None
+    else:
+        visible = inWindow(xs, ys, window)
+        if visible.sum() <= threshold:
+            return {column: values[visible] for column, values in data.items()}, emptyDensity()
+
+    density = binDensity(xs, ys, window, bins)
+    return {column: values[:0] for column, values in data.items()}, density
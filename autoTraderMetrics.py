@@ -0,0 +1,281 @@
+import http.server
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+'''
+Instrumentation for the web scrapers - where the time goes in a run, and how much work each
+stage did.
+
+Stages record into the one Metrics registry of the process, metrics: counters (pages
+fetched, listings dropped by dfGoodFormat, ...) and histograms (fetch latency, response
+size, parse time, listings per page, ...), each optionally split by labels such as the
+HTTP status. Histograms use fixed buckets, the same way Prometheus does, so recording a
+value costs the same however long the run.
+
+At the end of a run writeReport logs a summary, writes every metric to a JSON file and, if
+PROMETHEUS_FILE is set, to a Prometheus text file (e.g. for the node exporter's textfile
+collector). With METRICS_PORT set, startMetricsServer serves the live metrics in the
+Prometheus text format on http://host:METRICS_PORT/metrics for the length of the run.
+
+Console output goes through logging - configureLogging sets the level. Per page messages are
+logged at DEBUG, so they cost next to nothing at the default INFO level.
+'''
+
+METRICS_ENABLED = True # False makes recording a metric a no-op
+METRICS_JSON_FILE = "usedCarScrapeMetrics.json"
+PROMETHEUS_FILE = None # Also write the metrics in the Prometheus text format to this file - None to not
+METRICS_PORT = None # Serve /metrics on this port while scraping - None for no server
+METRIC_PREFIX = "autotrader_"
+LOG_LEVEL = "INFO" # DEBUG also logs every page
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 5e6)
+LISTING_BUCKETS = (0, 1, 2, 4, 8, 12, 24, 50, 100, 500, 1000)
+# name -> (type, help, histogram buckets)
+METRICS = {
+    "http_request_seconds": ("histogram", "Time taken by each HTTP request attempt", SECONDS_BUCKETS),
+    "http_response_bytes": ("histogram", "Size of each HTTP response body", BYTES_BUCKETS),
+    "http_responses_total": ("counter", "HTTP responses by status code", None),
+    "http_errors_total": ("counter", "HTTP requests that failed without a response - connection errors and timeouts", None),
+    "http_retries_total": ("counter", "HTTP request attempts that were retried", None),
+    "http_blocked_total": ("counter", "HTTP responses classed as blocks - 403, 429 or a captcha page", None),
+    "rate_limit_wait_seconds": ("histogram", "Time each HTTP request waited on the rate limiter", SECONDS_BUCKETS),
+    "pages_total": ("counter", "Search pages by result - ok, failed or blocked", None),
+    "parse_seconds": ("histogram", "Time taken to parse each search page", SECONDS_BUCKETS),
+    "listings_per_page": ("histogram", "Listings found on each search page", LISTING_BUCKETS),
+    "extract_seconds": ("histogram", "Time taken by extractAttributes for each make/model", SECONDS_BUCKETS),
+    "format_seconds": ("histogram", "Time taken by dfGoodFormat for each make/model", SECONDS_BUCKETS),
+    "listings_dropped_total": ("counter", "Listings dropped by reason - missing_values, duplicate or cross_model_duplicate", None),
+    "listings_total": ("counter", "Listings kept", None),
+    "makemodel_seconds": ("histogram", "Time taken to scrape each make/model", SECONDS_BUCKETS),
+    "makemodels_total": ("counter", "Make/models scraped", None),
+    "checkpoint_write_seconds": ("histogram", "Time taken to checkpoint each make/model", SECONDS_BUCKETS),
+    "dedupe_seconds": ("histogram", "Time taken to drop cross make/model duplicates from each batch", SECONDS_BUCKETS),
+    "output_write_seconds": ("histogram", "Time taken to write each output file by format", SECONDS_BUCKETS),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def configureLogging(level=LOG_LEVEL):
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+
+
+def labelKey(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Metrics():
+
+        def __init__(self, enabled=METRICS_ENABLED):
+            self.enabled = enabled
+            self.lock = threading.Lock()
+            self.reset()
+
+
+        '''
+        Forget everything recorded so far - for starting a new run
+        '''
+        def reset(self):
+            with self.lock:
+                self.startedAt = time.time()
+                self.counters = {} # (name, labelKey) -> value
+                self.histograms = {} # (name, labelKey) -> [bucket counts, count, sum, min, max]
+
+
+        def count(self, name, value=1, **labels):
+            if not self.enabled:
+                return
+            key = (name, labelKey(labels))
+            with self.lock:
+                self.counters[key] = self.counters.get(key, 0) + value
+
+
+        def observe(self, name, value, **labels):
+            if not self.enabled:
+                return
+            buckets = METRICS[name][2]
+            key = (name, labelKey(labels))
+            with self.lock:
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = [[0] * len(buckets), 0, 0.0, value, value]
+                for i, bound in enumerate(buckets):
+                    if value <= bound:
+                        histogram[0][i] = histogram[0][i] + 1
+                        break
+                histogram[1] = histogram[1] + 1
+                histogram[2] = histogram[2] + value
+                histogram[3] = min(histogram[3], value)
+                histogram[4] = max(histogram[4], value)
+
+
+        '''
+        Observe how many seconds the body of a with block takes
+        '''
+        @contextmanager
+        def timer(self, name, **labels):
+            if not self.enabled:
+                yield
+                return
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.observe(name, time.perf_counter() - start, **labels)
+
+
+        '''
+        Total of a counter over all its labels, or for the labels given
+        '''
+        def total(self, name, **labels):
+            with self.lock:
+                if labels:
+                    return self.counters.get((name, labelKey(labels)), 0)
+                return sum(value for (counterName, key), value in self.counters.items() if counterName == name)
+
+
+        '''
+        Upper bound of the bucket holding quantile q of a histogram - capped at its max
+        '''
+        def quantile(self, histogram, q, buckets):
+            bucketCounts, count, total, minimum, maximum = histogram
+            seen = 0
+            for bound, bucketCount in zip(buckets, bucketCounts):
+                seen = seen + bucketCount
+                if seen >= q * count:
+                    return min(bound, maximum)
+            return maximum
+
+
+        '''
+        Everything recorded, as a dict ready for JSON
+        '''
+        def summary(self):
+            finishedAt = time.time()
+            with self.lock:
+                counters = {}
+                for (name, key), value in sorted(self.counters.items()):
+                    counters.setdefault(name, []).append({"labels": dict(key), "value": value})
+                histograms = {}
+                for (name, key), histogram in sorted(self.histograms.items()):
+                    buckets = METRICS[name][2]
+                    bucketCounts, count, total, minimum, maximum = histogram
+                    histograms.setdefault(name, []).append({
+                        "labels": dict(key), "count": count, "sum": total, "mean": total / count,
+                        "min": minimum, "max": maximum,
+                        "p50": self.quantile(histogram, 0.5, buckets), "p95": self.quantile(histogram, 0.95, buckets),
+                        "buckets": {str(bound): bucketCount for bound, bucketCount in zip(buckets, bucketCounts)}})
+            return {"startedAt": self.startedAt, "finishedAt": finishedAt, "durationSeconds": finishedAt - self.startedAt,
+                    "counters": counters, "histograms": histograms}
+
+
+        '''
+        Every metric in the Prometheus text exposition format
+        '''
+        def prometheusText(self):
+            lines = []
+            with self.lock:
+                counters = sorted(self.counters.items())
+                histograms = sorted((key, [list(histogram[0])] + histogram[1:]) for key, histogram in self.histograms.items())
+            described = set()
+            for (name, key), value in counters:
+                lines.extend(self.describe(name, described))
+                lines.append(METRIC_PREFIX + name + self.labelText(key) + " " + repr(float(value)))
+            for (name, key), histogram in histograms:
+                lines.extend(self.describe(name, described))
+                bucketCounts, count, total, minimum, maximum = histogram
+                cumulative = 0
+                for bound, bucketCount in zip(METRICS[name][2], bucketCounts):
+                    cumulative = cumulative + bucketCount
+                    lines.append(METRIC_PREFIX + name + "_bucket" + self.labelText(key + (("le", repr(float(bound))),)) + " " + str(cumulative))
+                lines.append(METRIC_PREFIX + name + "_bucket" + self.labelText(key + (("le", "+Inf"),)) + " " + str(count))
+                lines.append(METRIC_PREFIX + name + "_sum" + self.labelText(key) + " " + repr(float(total)))
+                lines.append(METRIC_PREFIX + name + "_count" + self.labelText(key) + " " + str(count))
+            return "\n".join(lines) + "\n"
+
+
+        def describe(self, name, described):
+            if name in described:
+                return []
+            described.add(name)
+            metricType, helpText, buckets = METRICS[name]
+            return ["# HELP " + METRIC_PREFIX + name + " " + helpText, "# TYPE " + METRIC_PREFIX + name + " " + metricType]
+
+
+        def labelText(self, key):
+            if not key:
+                return ""
+            return "{" + ",".join(name + '="' + value.replace("\\", "\\\\").replace('"', '\\"') + '"' for name, value in key) + "}"
+
+
+        '''
+        Log a summary of the run, and write every metric to jsonPath (plus PROMETHEUS_FILE if
+        set). extra is added to the JSON - e.g. settings the run was made with.
+        '''
+        def writeReport(self, jsonPath=METRICS_JSON_FILE, prometheusPath=PROMETHEUS_FILE, **extra):
+            summary = self.summary()
+            summary.update(extra)
+            with open(jsonPath, "w") as f:
+                json.dump(summary, f, indent=2)
+            if prometheusPath is not None:
+                with open(prometheusPath, "w") as f:
+                    f.write(self.prometheusText())
+
+            duration = max(summary["durationSeconds"], 1e-9)
+            logger.info("Run took %.1f s - %d pages (%.2f per second), %d listings kept (%.2f per second)",
+                        duration, self.total("pages_total"), self.total("pages_total") / duration,
+                        self.total("listings_total"), self.total("listings_total") / duration)
+            for name, series in summary["histograms"].items():
+                for histogram in series:
+                    logger.info("%s%s: count %d, total %.3f, mean %.4f, p95 %.4f, max %.4f", name,
+                                " " + str(histogram["labels"]) if histogram["labels"] else "", histogram["count"],
+                                histogram["sum"], histogram["mean"], histogram["p95"], histogram["max"])
+            for name, series in summary["counters"].items():
+                for counter in series:
+                    logger.info("%s%s: %s", name, " " + str(counter["labels"]) if counter["labels"] else "", counter["value"])
+            logger.info("Metrics written to %s", jsonPath)
+
+
+# The registry every stage of this process records into
+metrics = Metrics()
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheusText().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+        def log_message(self, *args):
+            pass
+
+
+'''
+Serve /metrics on port from a background thread - returns the server to shutdown() at the
+end of the run, or None if port is None
+'''
+def startMetricsServer(port=METRICS_PORT):
+    if port is None:
+        return None
+    server = http.server.ThreadingHTTPServer(("", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Serving metrics on http://localhost:%d/metrics", port)
+    return server
+
+
+def stopMetricsServer(server):
+    if server is not None:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,316 @@
+import logging
+import os
+import shutil
+import sqlite3
+from urllib.parse import quote
+import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # pyarrow is optional - everything but the Parquet output is written without it
+    pa = None
+    pq = None
+from autoTraderMetrics import metrics
+from autoTraderStatsCube import StatsCubeSink, STATS_CUBE_FILE
+
+'''
+Output files for the scraped used car dataset.
+
+The dataset is written a batch of listings at a time to a set of sinks, so it never has to
+be held in memory in full - writeOutput takes any iterable of batches, e.g. a generator
+reading them from the checkpoint store:
+
+    csv     - CSV_OUT_FILE, appended to a batch at a time
+    parquet - PARQUET_OUT_DIR, a row group at a time (see below)
+    sqlite  - SQLITE_OUT_FILE, a listings table indexed for autoTraderQuery.py
+    stats   - STATS_CUBE_FILE, the market statistics cube (see autoTraderStatsCube.py), added
+              to a batch at a time
+    pkl     - a pickled df, as the bokeh app reads. A pickle can only be written whole, so
+              this is the one sink that keeps every batch in memory until the end - leave
+              it out of the sinks to keep memory flat however large the catalogue is
+
+The Parquet dataset is partitioned by Make, i.e. one directory per make
+(PARQUET_OUT_DIR/Make=Audi/...), with a typed schema:
+
+    Make, Model, Trans, Fuel - categorical (dictionary encoded)
+    Name                     - string
+    Price, Miles, BHP, L     - float32
+    Year                     - int16
+
+Listings come in make and model order, so each make's rows are sorted by model and
+readParquet can load one make/model by only opening that make's directory and skipping
+row groups of other models, rather than loading the whole dataset as a pkl or csv has to
+be. Only the rows of the make being written are buffered, up to PARQUET_ROW_GROUP_SIZE.
+
+Every sink writes to a temporary path and only replaces the previous output when closed.
+'''
+
+PARQUET_OUT_DIR = "usedCarAutoTraderOutput.parquet"
+CSV_OUT_FILE = "usedCarAutoTraderOutput.csv"
+PARQUET_COMPRESSION = "snappy"
+PARQUET_ROW_GROUP_SIZE = 50000 # Rows per row group - smaller lets reads skip more, bigger compresses better
+SQLITE_OUT_FILE = "usedCarAutoTraderOutput.db"
+OUTPUT_BATCH_SIZE = 10000 # Listings read from the checkpoint store and written to the sinks at a time
+OUTPUT_COLUMNS = ['Make', 'Model', 'Name', 'Price', 'Year', 'Miles', 'BHP', 'L', 'Trans', 'Fuel']
+OUTPUT_DTYPES = {'Make': 'category',
+                 'Model': 'category',
+                 'Name': object,
+                 'Price': 'float32',
+                 'Year': 'int16',
+                 'Miles': 'float32',
+                 'BHP': 'float32',
+                 'L': 'float32',
+                 'Trans': 'category',
+                 'Fuel': 'category'}
+
+logger = logging.getLogger(__name__)
+
+
+'''
+Cast the dataset to the output schema. dfGoodFormat drops every listing with a NAN, so
+Year always has a value and fits int16.
+'''
+def toOutputSchema(dfAllData):
+    return dfAllData.astype(OUTPUT_DTYPES)
+
+
+def replacePath(tempPath, path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tempPath, path)
+
+
+class PklSink():
+
+        name = "pkl"
+
+        def __init__(self, path):
+            self.path = path
+            self.batches = []
+
+
+        def write(self, dfBatch):
+            self.batches.append(dfBatch)
+
+
+        def close(self):
+            if self.batches:
+                dfAllData = pd.concat(self.batches, ignore_index=True)
+            else:
+                dfAllData = pd.DataFrame(columns=OUTPUT_COLUMNS)
+            self.batches = []
+            dfAllData.to_pickle(self.path + ".tmp")
+            replacePath(self.path + ".tmp", self.path)
+
+
+class CsvSink():
+
+        name = "csv"
+
+        def __init__(self, path=CSV_OUT_FILE):
+            self.path = path
+            self.file = open(path + ".tmp", "w", newline="", encoding="utf-8")
+            self.rows = 0
+            self.headerWritten = False
+
+
+        '''
+        Append a batch - numbered on from the last, so the file is the same as writing the
+        whole dataset with to_csv
+        '''
+        def write(self, dfBatch):
+            dfBatch = dfBatch.set_axis(pd.RangeIndex(self.rows, self.rows + dfBatch.shape[0]))
+            dfBatch.to_csv(self.file, header=not self.headerWritten)
+            self.headerWritten = True
+            self.rows = self.rows + dfBatch.shape[0]
+
+
+        def close(self):
+            if not self.headerWritten:
+                pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(self.file)
+            self.file.close()
+            replacePath(self.path + ".tmp", self.path)
+
+
+'''
+Writes the Parquet dataset partitioned by Make. The rows of the make being written are
+buffered and written as a row group every rowGroupSize rows, and its file is closed once
+the next make starts. If a make comes up again later it goes in another file in the same
+partition.
+'''
+class ParquetSink():
+
+        name = "parquet"
+
+        def __init__(self, path=PARQUET_OUT_DIR, compression=PARQUET_COMPRESSION, rowGroupSize=PARQUET_ROW_GROUP_SIZE):
+            if pq is None:
+                raise ImportError("pyarrow is required for Parquet output - pip install pyarrow")
+            self.path = path
+            self.tempPath = path + ".tmp"
+            self.compression = compression
+            self.rowGroupSize = rowGroupSize
+            self.schema = pa.schema([(column, pa.dictionary(pa.int32(), pa.string()) if dtype == 'category'
+                                      else pa.string() if dtype is object else pa.from_numpy_dtype(dtype))
+                                     for column, dtype in OUTPUT_DTYPES.items() if column != 'Make'])
+            if os.path.isdir(self.tempPath):
+                shutil.rmtree(self.tempPath)
+            os.makedirs(self.tempPath)
+            self.make = None
+            self.writer = None
+            self.buffer = []
+            self.bufferedRows = 0
+            self.fileCounts = {} # make -> files written to its partition
+
+
+        def write(self, dfBatch):
+            for make, dfMake in toOutputSchema(dfBatch).groupby('Make', sort=False, observed=True):
+                if make != self.make:
+                    self.closeMake()
+                    self.openMake(make)
+                self.buffer.append(dfMake.drop(columns='Make'))
+                self.bufferedRows = self.bufferedRows + dfMake.shape[0]
+                if self.bufferedRows >= self.rowGroupSize:
+                    self.flush()
+
+
+        def openMake(self, make):
+            partition = os.path.join(self.tempPath, "Make=" + quote(str(make), safe=""))
+            os.makedirs(partition, exist_ok=True)
+            fileCount = self.fileCounts.get(make, 0)
+            self.fileCounts[make] = fileCount + 1
+            self.writer = pq.ParquetWriter(os.path.join(partition, "part-" + str(fileCount) + ".parquet"), self.schema,
+                                           compression=self.compression)
+            self.make = make
+
+
+        def flush(self):
+            if self.buffer:
+                dfRows = pd.concat(self.buffer)
+                table = pa.Table.from_pandas(dfRows, schema=self.schema, preserve_index=False)
+                self.writer.write_table(table, row_group_size=self.rowGroupSize)
+            self.buffer = []
+            self.bufferedRows = 0
+
+
+        def closeMake(self):
+            if self.writer is not None:
+                self.flush()
+                self.writer.close()
+                self.writer = None
+            self.make = None
+
+
+        def close(self):
+            self.closeMake()
+            replacePath(self.tempPath, self.path)
+
+
+'''
+Writes the dataset to a SQLite file - one listings table, indexed once every row is in for
+the filters of autoTraderQuery.py: by make and model, by each numeric range column and by
+fuel and transmission, then price and miles. ANALYZE then gives the query planner the row counts
+to pick the most selective index for each filter.
+'''
+class SqliteSink():
+
+        name = "sqlite"
+
+        def __init__(self, path=SQLITE_OUT_FILE):
+            self.path = path
+            if os.path.exists(path + ".tmp"):
+                os.remove(path + ".tmp")
+            self.connection = sqlite3.connect(path + ".tmp")
+            self.connection.execute("""CREATE TABLE listings (Make TEXT, Model TEXT, Name TEXT, Price REAL, Year INTEGER,
+                                                            Miles REAL, BHP REAL, L REAL, Trans TEXT, Fuel TEXT)""")
+
+
+        def write(self, dfBatch):
+            with self.connection:
+                self.connection.executemany("INSERT INTO listings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                            dfBatch[OUTPUT_COLUMNS].itertuples(index=False, name=None))
+
+
+        def close(self):
+            with self.connection:
+                self.connection.executescript("""
+                    CREATE INDEX listingsMakeModel ON listings (Make, Model);
+                    CREATE INDEX listingsPrice ON listings (Price);
+                    CREATE INDEX listingsYear ON listings (Year);
+                    CREATE INDEX listingsMiles ON listings (Miles);
+                    CREATE INDEX listingsBHP ON listings (BHP);
+                    CREATE INDEX listingsFuelTrans ON listings (Fuel, Trans, Price, Miles);
+                    ANALYZE;
+                """)
+            self.connection.close()
+            os.replace(self.path + ".tmp", self.path)
+
+
+'''
+Write the dataset as Parquet partitioned by Make, replacing anything already at path
+'''
+def writeParquet(dfAllData, path=PARQUET_OUT_DIR, compression=PARQUET_COMPRESSION):
+    sink = ParquetSink(path, compression)
+    sink.write(dfAllData.sort_values(['Make', 'Model'], kind='stable'))
+    sink.close()
+
+
+'''
+Load the Parquet dataset, or just one make and/or model of it. The make and model filters
+are pushed down into the read, so only matching partitions and row groups are loaded.
+columns limits which columns are read.
+'''
+def readParquet(path=PARQUET_OUT_DIR, make=None, model=None, columns=None):
+    if pq is None:
+        raise ImportError("pyarrow is required to read Parquet output - pip install pyarrow")
+    filters = []
+    if make is not None:
+        filters.append(('Make', '=', make))
+    if model is not None:
+        filters.append(('Model', '=', model))
+    table = pq.read_table(path, columns=columns, filters=filters or None)
+    dfRead = table.to_pandas()
+    # The Make partition comes back last - put the columns back in dataset order
+    return dfRead[[column for column in OUTPUT_DTYPES if column in dfRead.columns]]
+
+
+'''
+Open the sinks named in sinkNames ("pkl", "csv", "parquet", "sqlite", "stats"). Parquet is
+skipped, with a warning, if pyarrow is not installed.
+'''
+def openSinks(sinkNames, pklOut, csvOut=CSV_OUT_FILE, parquetOut=PARQUET_OUT_DIR, sqliteOut=SQLITE_OUT_FILE,
+              statsOut=STATS_CUBE_FILE):
+    sinks = []
+    for sinkName in sinkNames:
+        if sinkName == "pkl":
+            sinks.append(PklSink(pklOut))
+        elif sinkName == "csv":
+            sinks.append(CsvSink(csvOut))
+        elif sinkName == "parquet":
+            try:
+                sinks.append(ParquetSink(parquetOut))
+            except ImportError as e:
+                logger.warning("%s - skipping Parquet output", e)
+        elif sinkName == "sqlite":
+            sinks.append(SqliteSink(sqliteOut))
+        elif sinkName == "stats":
+            sinks.append(StatsCubeSink(statsOut))
+        else:
+            raise ValueError("Unknown output sink: " + str(sinkName))
+    return sinks
+
+
+'''
+Write every batch of listings from batches to every sink, then close them. Returns the
+number of listings written.
+'''
+def writeOutput(batches, sinks):
+    rows = 0
+    for dfBatch in batches:
+        for sink in sinks:
+            with metrics.timer("output_write_seconds", format=sink.name):
+                sink.write(dfBatch)
+        rows = rows + dfBatch.shape[0]
+    for sink in sinks:
+        with metrics.timer("output_write_seconds", format=sink.name):
+            sink.close()
+    return rows
@@ -0,0 +1,230 @@
+import codecs
+import logging
+import re
+from bs4 import BeautifulSoup
+from bs4.dammit import EncodingDetector
+try:
+    from lxml import etree
+except ImportError: # lxml is optional - BeautifulSoup is used instead
+    etree = None
+
+'''
+HTML parser backends for AutoTrader search result pages.
+
+A backend turns the raw bytes of a search page into a document with parse(), then pulls
+the name, key specs, price and advert ID of every listing out of that document with
+extractListings().
+Both backends return exactly what BeautifulSoup's .text gives for each element, so the
+attribute extraction in autoTraderUsedCarScrape.py behaves the same whichever is used.
+
+    lxml - libxml2 based parser. Finds the listing cards and prices in one XPath pass
+           over the tree. Requires lxml to be installed.
+    bs4  - BeautifulSoup with Python's html.parser. Slowest, but has no extra dependency,
+           so it is the fallback if lxml is not available.
+'''
+
+ADVERT_ID_PATTERN = re.compile(r"/car-details/(\d+)")
+
+
+'''
+Strip the car price out of the text of a vehicle-price element, e.g. "£21,950"
+'''
+def parsePrice(text):
+    value_arb = text[1:]
+    value_arb2 = value_arb.split('£')
+    int_val = float(value_arb2[-1].replace(',', ''))
+    return int_val
+
+
+'''
+Advert ID of a listing from the href of its card's link, e.g. "/car-details/201905249283512?..."
+gives "201905249283512". Falls back to the href itself if it is not a car-details link, and
+None if the card has no link.
+'''
+def parseAdvertId(href):
+    if not href:
+        return None
+    match = ADVERT_ID_PATTERN.search(href)
+    return match.group(1) if match else href
+
+
+class BeautifulSoupListingParser():
+
+        name = "bs4"
+
+
+        def parse(self, content):
+            return BeautifulSoup(content, 'html.parser') # Parse from BS Object to HTML
+
+
+        '''
+        Strip the car name and get a list of all its main attributes from soup html.
+
+        Simplified example of HTML below:
+
+            <div class="information-container">
+            <h2 class="listing-title title-wrap">
+            <a class="js-click-handler" href="/car-details/201905249283512">Audi SQ5 3.0 BiTDi Tiptronic quattro (s/s) 5dr</a>
+            </h2>
+            <p class="listing-attention-grabber ">**300 BHP Four Wheel Drive**</p>
+            <ul class="listing-key-specs ">
+                <li>2016 (16 reg)</li>
+                <li>SUV</li>
+                <li>90,000 miles</li>
+                <li>3.0L</li>
+                <li>322bhp</li>
+                <li>Automatic</li>
+                <li>Diesel</li>
+            </ul>
+        '''
+        def getNamesFeatures(self, soup):
+            names = []
+            features = []
+            advertIds = []
+            for line in soup.find_all(class_="information-container"):
+                name = line.find('a')
+                feature = line.find('ul')
+                names.append(name.text)
+                features.append(feature.text)
+                advertIds.append(parseAdvertId(name.get('href')))
+            return names, features, advertIds
+
+
+        '''
+        Strip the car price out of the soup HTML
+
+        Simplified example of HTML below:
+
+        <a class="js-click-handler listing-fpa-link listings-price-link tracking-standard-link">
+
+                <div data-label="search appearance click" class="vehicle-price">£21,950</div>
+        </a>
+        '''
+        def getPrices(self, soup):
+            prices = []
+            for line in soup.find_all(class_="vehicle-price"):
+                prices.append(parsePrice(line.text))
+            return prices
+
+
+        def extractListings(self, soup):
+            names, features, advertIds = self.getNamesFeatures(soup)
+            prices = self.getPrices(soup)
+            return names, features, prices, advertIds
+
+
+        '''
+        Text of the first element with the given class, or None if there isn't one
+        '''
+        def findText(self, soup, className):
+            element = soup.find(class_=className)
+            return None if element is None else element.text
+
+
+class LxmlListingParser():
+
+        name = "lxml"
+        # Every listing card and every price, in document order, in one pass over the tree
+        LISTING_XPATH = ("//*[contains(concat(' ', normalize-space(@class), ' '), ' information-container ')"
+                         " or contains(concat(' ', normalize-space(@class), ' '), ' vehicle-price ')]")
+
+
+        def __init__(self):
+            if etree is None:
+                raise ImportError("lxml is required for the lxml parser backend - pip install lxml")
+            self.findListings = etree.XPath(self.LISTING_XPATH)
+            self.findName = etree.XPath("(.//a)[1]")
+            self.findFeatures = etree.XPath("(.//ul)[1]")
+
+
+        '''
+        Parse the raw response bytes straight into a tree - no decode to str first
+        '''
+        def parse(self, content):
+            if isinstance(content, str):
+                content = content.encode('utf-8')
+                encoding = 'utf-8'
+            else:
+                encoding = self.detectEncoding(content)
+            parser = etree.HTMLParser(encoding=encoding)
+            return etree.fromstring(content, parser)
+
+
+        '''
+        Encoding of the raw page bytes, picked in the same order BeautifulSoup picks it so both
+        backends read the same text: a byte order mark, then the page's meta charset, then
+        utf-8 if the bytes are valid utf-8, otherwise windows-1252. libxml2 left to itself reads
+        a page with no meta charset as latin-1, and forcing utf-8 garbles latin-1 pages.
+        '''
+        def detectEncoding(self, content):
+            encoding = EncodingDetector.strip_byte_order_mark(content)[1]
+            if encoding is None:
+                encoding = EncodingDetector.find_declared_encoding(content, is_html=True)
+            if encoding is not None:
+                try:
+                    codecs.lookup(encoding)
+                    return encoding
+                except LookupError: # Unknown charset - guess as if there was none
+                    pass
+            try:
+                content.decode('utf-8')
+                return 'utf-8'
+            except UnicodeDecodeError:
+                return 'windows-1252'
+
+
+        def extractListings(self, tree):
+            names = []
+            features = []
+            prices = []
+            advertIds = []
+            if tree is None: # Empty response
+                return names, features, prices, advertIds
+
+            for element in self.findListings(tree):
+                classes = (element.get('class') or '').split()
+                if 'information-container' in classes:
+                    name = self.findName(element)[0]
+                    names.append(self.textContent(name))
+                    features.append(self.textContent(self.findFeatures(element)[0]))
+                    advertIds.append(parseAdvertId(name.get('href')))
+                if 'vehicle-price' in classes:
+                    prices.append(parsePrice(self.textContent(element)))
+            return names, features, prices, advertIds
+
+
+        '''
+        Text of the first element with the given class, or None if there isn't one
+        '''
+        def findText(self, tree, className):
+            if tree is None:
+                return None
+            elements = tree.xpath("(//*[contains(concat(' ', normalize-space(@class), ' '), $className)])[1]",
+                                  className=' ' + className + ' ')
+            return self.textContent(elements[0]) if elements else None
+
+
+        '''
+        All text within an element, the same as BeautifulSoup's .text. BeautifulSoup
+        collapses any whitespace only string containing a newline down to a single newline,
+        so that is done here too.
+        '''
+        def textContent(self, element):
+            return "".join('\n' if '\n' in text and not text.strip() else text for text in element.itertext())
+
+
+PARSERS = {"lxml": LxmlListingParser,
+           "bs4": BeautifulSoupListingParser}
+
+logger = logging.getLogger(__name__)
+
+
+'''
+Create the requested parser backend, falling back to BeautifulSoup if it can't be used
+'''
+def getListingParser(backend="lxml"):
+    try:
+        return PARSERS[backend]()
+    except ImportError as e:
+        logger.warning("%s - falling back to the bs4 parser backend", e)
+        return BeautifulSoupListingParser()
@@ -0,0 +1,89 @@
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from autoTraderMetrics import metrics
+
+'''
+Process pool parsing stage for the used car web scraper.
+
+Fetch threads hand the raw HTML bytes of every page they download to a ParsePipeline and
+go straight back to fetching. The pages are parsed into listing columns by a pool of worker
+processes, so parsing runs on every core instead of on the one thread the fetching shares.
+
+At most queueSize pages can be waiting for or under parsing at once. When that limit is
+reached submit() blocks the fetch thread until a page finishes parsing, so if parsing falls
+behind the fetching is slowed down rather than unparsed pages piling up in memory.
+
+Metrics recorded in a worker process would be lost with it, so workers send back how long
+each page took alongside the parsed page, and it is recorded in this process.
+'''
+
+# The page parser each worker process parses with - created once per process by initParseWorker
+workerPageParser = None
+
+
+'''
+Set up a worker process. Only the page parser is created - no HTTP session, rate limiter or
+proxies. It is imported here rather than at the top of this module as
+autoTraderUsedCarScrape.py imports this module.
+'''
+def initParseWorker(parserBackend):
+    global workerPageParser
+    from autoTraderUsedCarScrape import SearchPageParser
+    metrics.enabled = False # Recorded by the pipeline in the main process instead
+    workerPageParser = SearchPageParser(parserBackend)
+
+
+'''
+Run in a worker process - parse one page's raw bytes into its listing columns and page
+count. Returns the parsed page and the seconds it took.
+'''
+def parsePageWorker(content):
+    start = time.perf_counter()
+    parsed = workerPageParser.parsePage(content)
+    return parsed, time.perf_counter() - start
+
+
+class ParsePipeline():
+
+        def __init__(self, workers, queueSize, parserBackend):
+            self.workers = workers
+            self.queueSize = queueSize
+            self.slots = threading.BoundedSemaphore(queueSize) # One slot per queued/in progress page
+            self.pool = ProcessPoolExecutor(max_workers=workers,
+                                            initializer=initParseWorker,
+                                            initargs=(parserBackend,))
+
+
+        '''
+        Queue the raw bytes of a page for parsing and return a Future of the parsed page.
+        Blocks while queueSize pages are already waiting for or under parsing.
+        '''
+        def submit(self, content):
+            self.slots.acquire()
+            try:
+                workerFuture = self.pool.submit(parsePageWorker, content)
+            except:
+                self.slots.release()
+                raise
+            future = Future()
+            workerFuture.add_done_callback(lambda workerFuture: self.parsed(workerFuture, future))
+            return future
+
+
+        '''
+        Record a worker's timing and pass its parsed page on to the Future handed out by submit
+        '''
+        def parsed(self, workerFuture, future):
+            self.slots.release()
+            if workerFuture.exception() is not None:
+                future.set_exception(workerFuture.exception())
+                return
+            parsed, elapsed = workerFuture.result()
+            metrics.observe("parse_seconds", elapsed)
+            metrics.observe("listings_per_page", len(parsed[0]['Name']))
+            future.set_result(parsed)
+
+
+        def close(self):
+            self.pool.shutdown()
@@ -0,0 +1,188 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from urllib.request import pathname2url
+import pandas as pd
+from autoTraderOutputStore import SQLITE_OUT_FILE, OUTPUT_COLUMNS
+
+'''
+Indexed queries over the SQLite output of the used car web scrape (the "sqlite" output sink,
+SQLITE_OUT_FILE), so a question about the dataset reads only the listings that answer it
+rather than loading the whole pkl into pandas.
+
+The listings table is indexed on Make/Model, on each of Price, Year, Miles and BHP, and on
+Fuel/Trans/Price/Miles (see SqliteSink in autoTraderOutputStore.py). Filters are keyword arguments
+named after the columns - a value for Make, Model, Fuel and Trans (or a list of values), and
+a (low, high) range for Price, Year, Miles and BHP. Ranges include low and exclude high, and
+either end can be None. E.g. diesel automatics under 15,000 pounds with under 60,000 miles:
+
+    from autoTraderQuery import ListingQuery
+    query = ListingQuery()
+    dfPage, cursor = query.page(Fuel="Diesel", Trans="Automatic", Price=(None, 15000), Miles=(None, 60000))
+    dfNext, cursor = query.page(cursor=cursor, Fuel="Diesel", ...) # and so on until cursor is None
+
+Results come a page at a time, in dataset order or ordered by one of the range columns. The
+cursor is the last row's position in that order, so every page is an index seek however far
+into the results it is, unlike LIMIT/OFFSET. iterPages walks every page for batch jobs, and
+rows gets every result at once for small selections such as one make/model.
+
+From the command line:
+
+python autoTraderQuery.py --fuel Diesel --trans Automatic --max-price 15000 --max-miles 60000
+'''
+
+PAGE_SIZE = 1000 # Listings per page
+EQUAL_COLUMNS = ['Make', 'Model', 'Fuel', 'Trans']
+RANGE_COLUMNS = ['Price', 'Year', 'Miles', 'BHP']
+ORDER_COLUMNS = ['rowid'] + RANGE_COLUMNS # rowid is dataset order - by make and model
+
+
+'''
+SQL conditions and their parameters for filters on the EQUAL_COLUMNS and RANGE_COLUMNS
+'''
+def whereClause(filters):
+    conditions = []
+    params = []
+    for column, value in filters.items():
+        if column in EQUAL_COLUMNS:
+            if isinstance(value, (list, tuple, set)):
+                values = list(value)
+                conditions.append(column + " IN (" + ", ".join("?" * len(values)) + ")")
+                params.extend(values)
+            else:
+                conditions.append(column + " = ?")
+                params.append(value)
+        elif column in RANGE_COLUMNS:
+            low, high = value
+            if low is not None:
+                conditions.append(column + " >= ?")
+                params.append(low)
+            if high is not None:
+                conditions.append(column + " < ?")
+                params.append(high)
+        else:
+            raise ValueError("Can't filter on " + str(column) + " - filter on one of " + str(EQUAL_COLUMNS + RANGE_COLUMNS))
+    return conditions, params
+
+
+class ListingQuery():
+
+        def __init__(self, path=SQLITE_OUT_FILE):
+            if not os.path.exists(path):
+                raise FileNotFoundError("No SQLite output at " + path + " - add \"sqlite\" to OUTPUT_SINKS and scrape again")
+            self.path = path
+            self.lock = threading.Lock() # Shared by every bokeh session's thread
+            self.connection = sqlite3.connect("file:" + pathname2url(os.path.abspath(path)) + "?mode=ro", uri=True,
+                                              check_same_thread=False)
+
+
+        '''
+        One page of the listings matching filters, ordered by orderBy (one of ORDER_COLUMNS).
+        Returns the page as a df and the cursor to pass for the next page - None once there
+        are no more.
+        '''
+        def page(self, pageSize=PAGE_SIZE, orderBy='rowid', descending=False, cursor=None, **filters):
+            if orderBy not in ORDER_COLUMNS:
+                raise ValueError("Can't order by " + str(orderBy) + " - order by one of " + str(ORDER_COLUMNS))
+            conditions, params = whereClause(filters)
+            keys = ['rowid'] if orderBy == 'rowid' else [orderBy, 'rowid']
+            direction = " DESC" if descending else ""
+            if cursor is not None:
+                conditions.append("(" + ", ".join(keys) + ") " + ("<" if descending else ">") +
+                                  " (" + ", ".join("?" * len(keys)) + ")")
+                params.extend(cursor)
+            sql = "SELECT rowid AS listingId, " + ", ".join(OUTPUT_COLUMNS) + " FROM listings"
+            if conditions:
+                sql = sql + " WHERE " + " AND ".join(conditions)
+            sql = sql + " ORDER BY " + ", ".join(key + direction for key in keys) + " LIMIT ?"
+            with self.lock:
+                dfPage = pd.read_sql_query(sql, self.connection, params=params + [pageSize])
+            if dfPage.shape[0] < pageSize:
+                return dfPage.drop(columns='listingId'), None
+            last = dfPage.iloc[-1]
+            nextCursor = tuple(last['listingId' if key == 'rowid' else key].item() for key in keys)
+            return dfPage.drop(columns='listingId'), nextCursor
+
+
+        '''
+        Generator of every page of the listings matching filters, for batch jobs
+        '''
+        def iterPages(self, pageSize=PAGE_SIZE, orderBy='rowid', descending=False, **filters):
+            cursor = None
+            while True:
+                dfPage, cursor = self.page(pageSize, orderBy, descending, cursor, **filters)
+                if dfPage.shape[0] > 0:
+                    yield dfPage
+                if cursor is None:
+                    return
+
+
+        '''
+        Every listing matching filters as one df, in dataset order
+        '''
+        def rows(self, **filters):
+            conditions, params = whereClause(filters)
+            sql = "SELECT " + ", ".join(OUTPUT_COLUMNS) + " FROM listings"
+            if conditions:
+                sql = sql + " WHERE " + " AND ".join(conditions)
+            with self.lock:
+                return pd.read_sql_query(sql + " ORDER BY rowid", self.connection, params=params)
+
+
+        def count(self, **filters):
+            conditions, params = whereClause(filters)
+            sql = "SELECT COUNT(*) FROM listings"
+            if conditions:
+                sql = sql + " WHERE " + " AND ".join(conditions)
+            with self.lock:
+                return self.connection.execute(sql, params).fetchone()[0]
+
+
+        '''
+        Each make's models in the order they first appear in the dataset, as the bokeh app's
+        drop downs list them
+        '''
+        def makeModels(self):
+            with self.lock:
+                rows = self.connection.execute("""SELECT Make, Model FROM listings GROUP BY Make, Model
+                                                  ORDER BY MIN(rowid)""").fetchall()
+            makeModels = {}
+            for make, model in rows:
+                makeModels.setdefault(make, []).append(model)
+            return makeModels
+
+
+        def close(self):
+            self.connection.close()
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Query the SQLite output of the used car web scrape")
+    argParser.add_argument("--db", default=SQLITE_OUT_FILE, help="SQLite output file (default " + SQLITE_OUT_FILE + ")")
+    for column in EQUAL_COLUMNS:
+        argParser.add_argument("--" + column.lower(), help="only listings with this " + column)
+    for column in RANGE_COLUMNS:
+        argParser.add_argument("--min-" + column.lower(), type=float, help="only listings with " + column + " at least this")
+        argParser.add_argument("--max-" + column.lower(), type=float, help="only listings with " + column + " under this")
+    argParser.add_argument("--order-by", default='rowid', choices=ORDER_COLUMNS)
+    argParser.add_argument("--descending", action="store_true")
+    argParser.add_argument("--page-size", type=int, default=50, help="listings to show (default 50)")
+    args = vars(argParser.parse_args())
+    filters = {column: args[column.lower()] for column in EQUAL_COLUMNS if args[column.lower()] is not None}
+    for column in RANGE_COLUMNS:
+        low = args["min_" + column.lower()]
+        high = args["max_" + column.lower()]
+        if low is not None or high is not None:
+            filters[column] = (low, high)
+
+    query = ListingQuery(args["db"])
+    start = time.perf_counter()
+    dfPage, cursor = query.page(args["page_size"], args["order_by"], args["descending"], **filters)
+    elapsed = time.perf_counter() - start
+    matches = query.count(**filters)
+    query.close()
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+        print(dfPage)
+    print("First %d of %d matching listings in %.1f ms" % (dfPage.shape[0], matches, elapsed * 1000))
@@ -0,0 +1,138 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+try:
+    import zstandard
+except ImportError: # zstandard is optional - pages are compressed with zlib without it
+    zstandard = None
+
+'''
+On disk cache of the raw search pages fetched by the used car web scrape, so the dataset
+can be rebuilt after a change to the parsing (getAttributeValues, dfGoodFormat, ...) without
+fetching anything again.
+
+Every page is compressed (zstd if zstandard is installed, zlib otherwise) and stored once
+under the blake2b hash of its content, in RESPONSE_CACHE_DIR/objects. A SQLite index maps
+each url and crawl date - the day of the run - to the content hash, so pages that come back
+the same on every crawl, or repeat on another url, only take up space once.
+
+In replay mode (python autoTraderUsedCarScrape.py --replay) pages are read from the cache
+instead of the website - from the latest crawl, or the crawl date given. The latest crawl
+date is looked up once for the run, so only pages of that one crawl are replayed: a url it
+doesn't have is a cache miss rather than a page from an older crawl. Nothing goes over the
+network, so rebuilding the dataset is only as slow as parsing the pages.
+'''
+
+RESPONSE_CACHE_DIR = "usedCarResponseCache"
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 6
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd" # Start of every zstd frame - zlib streams never start with it
+
+logger = logging.getLogger(__name__)
+
+
+class CacheMissError(Exception):
+        pass
+
+
+def compress(content):
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(content)
+    return zlib.compress(content, ZLIB_LEVEL)
+
+
+def decompress(data):
+    if data[:4] == ZSTD_MAGIC:
+        if zstandard is None:
+            raise ImportError("This cache holds zstd compressed pages - pip install zstandard to read them")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def crawlDateToday():
+    return time.strftime("%Y-%m-%d")
+
+
+class ResponseCache():
+
+        def __init__(self, path=RESPONSE_CACHE_DIR, crawlDate=None):
+            self.path = path
+            self.crawlDate = crawlDate or crawlDateToday()
+            os.makedirs(os.path.join(path, "objects"), exist_ok=True)
+            self.lock = threading.Lock() # Pages are cached from every fetch thread
+            self.connection = sqlite3.connect(os.path.join(path, "index.db"), check_same_thread=False)
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS responses (url TEXT, crawlDate TEXT, contentHash TEXT, fetchedAt REAL,
+                                                      PRIMARY KEY (url, crawlDate));
+            """)
+            self.pagesStored = 0
+            self.bytesIn = 0
+            self.bytesStored = 0
+
+
+        def objectPath(self, contentHash):
+            return os.path.join(self.path, "objects", contentHash[:2], contentHash[2:])
+
+
+        '''
+        Cache the raw content of url under this crawl's date
+        '''
+        def put(self, url, content):
+            contentHash = hashlib.blake2b(content, digest_size=20).hexdigest()
+            objectPath = self.objectPath(contentHash)
+            stored = 0
+            if not os.path.exists(objectPath):
+                data = compress(content)
+                os.makedirs(os.path.dirname(objectPath), exist_ok=True)
+                tempPath = objectPath + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+                with open(tempPath, 'wb') as f:
+                    f.write(data)
+                os.replace(tempPath, objectPath)
+                stored = len(data)
+            with self.lock:
+                with self.connection:
+                    self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                                            (url, self.crawlDate, contentHash, time.time()))
+                self.pagesStored = self.pagesStored + 1
+                self.bytesIn = self.bytesIn + len(content)
+                self.bytesStored = self.bytesStored + stored
+
+
+        '''
+        Date of the latest crawl in the cache, or None if nothing has been cached
+        '''
+        def latestCrawlDate(self):
+            with self.lock:
+                return self.connection.execute("SELECT MAX(crawlDate) FROM responses").fetchone()[0]
+
+
+        '''
+        Raw content of url from the crawl on crawlDate, or from the latest crawl of it if no
+        date is given. Raises CacheMissError if it was never cached.
+        '''
+        def get(self, url, crawlDate=None):
+            with self.lock:
+                if crawlDate is None:
+                    row = self.connection.execute("""SELECT contentHash FROM responses WHERE url = ?
+                                                     ORDER BY crawlDate DESC LIMIT 1""", (url,)).fetchone()
+                else:
+                    row = self.connection.execute("SELECT contentHash FROM responses WHERE url = ? AND crawlDate = ?",
+                                                  (url, crawlDate)).fetchone()
+            if row is None:
+                raise CacheMissError("No cached page for url: " + url)
+            with open(self.objectPath(row[0]), 'rb') as f:
+                return decompress(f.read())
+
+
+        def logStats(self):
+            if self.pagesStored:
+                logger.info("Pages cached: %d, %.1f MB raw, %.1f MB written to %s",
+                            self.pagesStored, self.bytesIn / 1e6, self.bytesStored / 1e6, self.path)
+
+
+        def close(self):
+            self.connection.close()
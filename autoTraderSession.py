@@ -0,0 +1,283 @@
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from autoTraderMetrics import metrics
+
+'''
+Shared HTTP transport for the AutoTrader web scrapers.
+
+Both autoTraderScrapeMakesModels.py and autoTraderUsedCarScrape.py request their pages
+through an AutoTraderSession. One requests.Session is kept open for the whole run so the
+TCP/TLS connection to the website is pooled and kept alive rather than re-opened for
+every page, and transient failures (dropped connections, timeouts, 5xx responses) are
+retried with exponential backoff and jitter before a page is given up on.
+
+Given a ProxyPool (autoTraderProxyPool.py) every request goes out through a proxy chosen by
+the pool, and how each request went is reported back to it. Rate limits are then kept per
+host per proxy, so each proxy is throttled and backs off on its own.
+
+Every response is classified before it is handed back to be parsed. A 403/429, or a page
+carrying one of BLOCK_MARKERS (a captcha or bot check served in place of the real page), is
+a block: the request rate to that host is cut and requests to it pause for a cool down, then
+the rate creeps back up while responses keep coming back fine (AdaptiveRateLimiter). So the
+rate settles just under whatever the website tolerates. A request still blocked after its
+retries raises BlockedError, so a block is never mistaken for a page with no listings.
+'''
+
+# Headers are sensible to add as it increases success rate
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/46.0.2490.80 Safari/537.36','Content-Type': 'text/html',}
+POOL_SIZE = 16 # Keep-alive connections held open per host
+MAX_RETRIES = 3 # Retries after the first attempt before a request is given up on
+BACKOFF_BASE = 0.5 # Seconds - doubled on every retry
+BACKOFF_MAX = 30.0 # Seconds - upper bound on any single backoff
+TIMEOUT = (5, 30) # Seconds - (connect, read)
+RETRY_STATUSES = (500, 502, 503, 504)
+BLOCKED_STATUSES = (403, 429)
+# Text only found on the bot check/captcha pages served instead of a blocked page
+BLOCK_MARKERS = (b"px-captcha", b"/cdn-cgi/challenge-platform", b"Pardon Our Interruption",
+                 b"Request unsuccessful. Incapsula incident", b"<title>Access Denied</title>")
+MIN_REQUESTS_PER_SECOND = 0.2 # Floor the adaptive rate is never cut below
+MAX_RATE_FACTOR = 2.0 # The adaptive rate can climb to this many times its starting rate
+RATE_INCREASE = 0.02 # Requests per second added to the adaptive rate per successful response
+RATE_DECREASE = 0.5 # Adaptive rate is multiplied by this on a block
+BLOCK_COOLDOWN = 30.0 # Seconds - no requests to a host after it blocks us (longer if it sends Retry-After)
+
+logger = logging.getLogger(__name__)
+
+
+class BlockedError(requests.HTTPError):
+        pass
+
+
+class HostRateLimiter():
+
+        def __init__(self, maxPerSecond):
+            self.maxPerSecond = maxPerSecond
+            self.lock = threading.Lock()
+            self.nextSlot = {} # host -> earliest time the next request may start
+
+
+        '''
+        Block the calling thread until the host's request rate allows another request.
+        Slots are handed out in order so concurrent workers are spread evenly over time.
+        '''
+        def wait(self, host):
+            if not self.maxPerSecond:
+                return
+            interval = 1.0 / self.maxPerSecond
+            with self.lock:
+                now = time.monotonic()
+                slot = max(now, self.nextSlot.get(host, now))
+                self.nextSlot[host] = slot + interval
+            delay = slot - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+
+        # Fixed rate - responses make no difference
+        def success(self, host):
+            pass
+
+
+        def blocked(self, host, retryAfter=None):
+            pass
+
+
+        def rates(self):
+            return {}
+
+
+'''
+Per host token bucket, refilled at a rate that adapts to how the website responds.
+
+Requests are handed one token each, spaced 1/rate apart. Every successful response adds
+increase to the rate, up to maxPerSecond. A block multiplies the rate by decrease, down to
+minPerSecond, and holds every request to the host until a cool down has passed. Blocks of
+requests already in flight during the cool down count as one.
+'''
+class AdaptiveRateLimiter():
+
+        def __init__(self, startPerSecond, minPerSecond=MIN_REQUESTS_PER_SECOND, maxPerSecond=None,
+                     increase=RATE_INCREASE, decrease=RATE_DECREASE, cooldown=BLOCK_COOLDOWN):
+            self.startPerSecond = startPerSecond
+            self.minPerSecond = min(minPerSecond, startPerSecond)
+            self.maxPerSecond = maxPerSecond or startPerSecond * MAX_RATE_FACTOR
+            self.increase = increase
+            self.decrease = decrease
+            self.cooldown = cooldown
+            self.lock = threading.Lock()
+            self.rate = {} # host -> requests per second
+            self.nextSlot = {} # host -> earliest time the next request may start
+            self.coolUntil = {} # host -> end of its current cool down
+
+
+        '''
+        Block the calling thread until the host's bucket has a token for it, and no cool
+        down is in progress - checked again after waiting in case a block came in meanwhile
+        '''
+        def wait(self, host):
+            while True:
+                with self.lock:
+                    now = time.monotonic()
+                    coolUntil = self.coolUntil.get(host, now)
+                    if now >= coolUntil:
+                        slot = max(now, self.nextSlot.get(host, now))
+                        self.nextSlot[host] = slot + 1.0 / self.rate.setdefault(host, self.startPerSecond)
+                delay = (slot if now >= coolUntil else coolUntil) - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                if now >= coolUntil and time.monotonic() >= self.coolUntil.get(host, 0):
+                    return
+
+
+        def success(self, host):
+            with self.lock:
+                if time.monotonic() < self.coolUntil.get(host, 0):
+                    return
+                self.rate[host] = min(self.maxPerSecond, self.rate.get(host, self.startPerSecond) + self.increase)
+
+
+        def blocked(self, host, retryAfter=None):
+            with self.lock:
+                now = time.monotonic()
+                if now < self.coolUntil.get(host, 0):
+                    return # Already backing off from this block
+                self.rate[host] = max(self.minPerSecond, self.rate.get(host, self.startPerSecond) * self.decrease)
+                self.coolUntil[host] = now + max(self.cooldown, retryAfter or 0)
+                self.nextSlot[host] = self.coolUntil[host]
+
+
+        '''
+        Requests per second each host has got to
+        '''
+        def rates(self):
+            with self.lock:
+                return dict(self.rate)
+
+
+class AutoTraderSession():
+
+        def __init__(self, proxyPool=None, headers=HEADERS,
+                     maxRetries=MAX_RETRIES, backoffBase=BACKOFF_BASE, backoffMax=BACKOFF_MAX,
+                     timeout=TIMEOUT, poolSize=POOL_SIZE, maxRequestsPerSecond=None,
+                     adaptiveRate=True, blockMarkers=BLOCK_MARKERS):
+            self.proxyPool = proxyPool
+            self.maxRetries = maxRetries
+            self.backoffBase = backoffBase
+            self.backoffMax = backoffMax
+            self.timeout = timeout
+            self.blockMarkers = blockMarkers
+            self.blockedCount = 0
+            self.countLock = threading.Lock()
+            if adaptiveRate and maxRequestsPerSecond:
+                self.rateLimiter = AdaptiveRateLimiter(maxRequestsPerSecond)
+            else:
+                self.rateLimiter = HostRateLimiter(maxRequestsPerSecond)
+
+            # Retries are handled in get() so the adapter itself never retries
+            adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize, max_retries=0)
+            self.session = requests.Session()
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+            self.session.headers.update(headers)
+
+
+        '''
+        Exponential backoff with full jitter for the given retry attempt (0 based), so that
+        concurrent workers that failed together do not all retry at the same moment.
+        '''
+        def backoffDelay(self, attempt):
+            ceiling = min(self.backoffMax, self.backoffBase * (2 ** attempt))
+            return random.uniform(0, ceiling)
+
+
+        '''
+        Whether a response is the website blocking us rather than the page asked for
+        '''
+        def isBlocked(self, response):
+            if response.status_code in BLOCKED_STATUSES:
+                return True
+            content = response.content or b""
+            return any(marker in content for marker in self.blockMarkers)
+
+
+        '''
+        Seconds the website asked us to wait in a Retry-After header, if it gave a number
+        '''
+        def retryAfter(self, response):
+            try:
+                return float(response.headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                return None
+
+
+        '''
+        GET a url over the pooled session, retrying connection errors, timeouts, blocks and
+        RETRY_STATUSES responses. Any other response is returned as is. Raises the last
+        error once all retries are used up - BlockedError if it was a block.
+
+        With a proxy pool every attempt asks the pool for a proxy - proxyKey (e.g. the
+        make/model) keeps related requests on one proxy if the pool rotates that way.
+        '''
+        def get(self, url, proxyKey=None, **kwargs):
+            kwargs.setdefault('timeout', self.timeout)
+            attempt = 0
+            while True:
+                proxy = None
+                host = urlparse(url).netloc
+                if self.proxyPool is not None:
+                    proxy = self.proxyPool.choose(proxyKey)
+                    kwargs['proxies'] = proxy.settings
+                    host = host + " via " + proxy.name
+                with metrics.timer("rate_limit_wait_seconds"):
+                    self.rateLimiter.wait(host)
+                start = time.monotonic()
+                try:
+                    response = self.session.get(url, **kwargs)
+                    metrics.observe("http_request_seconds", time.monotonic() - start)
+                    metrics.observe("http_response_bytes", len(response.content))
+                    metrics.count("http_responses_total", status=response.status_code)
+                    if self.isBlocked(response):
+                        metrics.count("http_blocked_total")
+                        with self.countLock:
+                            self.blockedCount = self.blockedCount + 1
+                        self.rateLimiter.blocked(host, self.retryAfter(response))
+                        self.recordProxy(proxy, proxyKey, False, time.monotonic() - start, blocked=True)
+                        error = BlockedError(str(response.status_code) + " blocked response for url: " + url, response=response)
+                    elif response.status_code not in RETRY_STATUSES:
+                        self.rateLimiter.success(host)
+                        self.recordProxy(proxy, proxyKey, True, time.monotonic() - start)
+                        return response
+                    else:
+                        self.recordProxy(proxy, proxyKey, True, time.monotonic() - start) # The website failed, not the proxy
+                        error = requests.HTTPError(str(response.status_code) + " response for url: " + url, response=response)
+                except (requests.ConnectionError, requests.Timeout) as e: # Includes ProxyError
+                    metrics.count("http_errors_total", error=type(e).__name__)
+                    self.recordProxy(proxy, proxyKey, False)
+                    error = e
+
+                if attempt >= self.maxRetries:
+                    raise error
+                metrics.count("http_retries_total")
+                logger.debug("Retrying %s after: %s", url, error)
+                time.sleep(self.backoffDelay(attempt))
+                attempt = attempt + 1
+
+
+        def recordProxy(self, proxy, proxyKey, ok, latency=None, blocked=False):
+            if proxy is not None:
+                self.proxyPool.record(proxy, ok, latency, blocked, proxyKey)
+
+
+        def logBlockStats(self):
+            logger.info("Blocked responses: %d", self.blockedCount)
+            for host, rate in self.rateLimiter.rates().items():
+                logger.info("Request rate to %s adapted to: %.2f per second", host, rate)
+
+
+        def close(self):
+            self.session.close()
@@ -0,0 +1,255 @@
+import argparse
+import logging
+import math
+import os
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+
+'''
+Precomputed market statistics of the used car dataset, so price analytics don't have to go
+back to the raw listings.
+
+The cube has one cell per Make, Model, Year, Fuel and Trans. Every cell holds only values
+that can be added together - the listing count, sums of price, miles and year and of their
+squares and products, the lowest and highest miles - and a sketch of its prices. So a batch
+of listings is added to the cube by adding its cells to the ones already there, and any
+rollup (e.g. per Make/Model, or per Make/Model/Year) is a sum of cells:
+
+    MedianPrice, P10...P90 - quantiles from the merged price sketches
+    PricePerMile           - least squares slope of price against miles (negative - the
+                             value a car loses per mile)
+    DepreciationPerYear    - least squares slope of price against year (the value a car
+                             loses per year older)
+
+The price sketch counts prices in logarithmic buckets, each SKETCH_ACCURACY wider than the
+last (as DDSketch does), so sketches merge by adding counts and every quantile is within
+SKETCH_ACCURACY of the true price. Slopes need at least two different miles, or years, in
+the cells rolled up - otherwise they are NAN.
+
+The cube is stored in STATS_CUBE_FILE (SQLite) and built a batch at a time by the "stats"
+output sink as the dataset is written (see autoTraderOutputStore.py). To build or add to it
+from an existing output file instead:
+
+python autoTraderStatsCube.py usedCarAutoTraderOutput.pkl
+
+and to read it:
+
+    from autoTraderStatsCube import StatsCube
+    dfStats = StatsCube().summary(['Make', 'Model', 'Year'], make="Audi", model="A4")
+'''
+
+STATS_CUBE_FILE = "usedCarStatsCube.db"
+CUBE_KEYS = ['Make', 'Model', 'Year', 'Fuel', 'Trans']
+SUM_COLUMNS = ['Count', 'SumPrice', 'SumMiles', 'SumMilesSq', 'SumMilesPrice', 'SumYear', 'SumYearSq', 'SumYearPrice']
+QUANTILES = {'P10': 0.1, 'P25': 0.25, 'MedianPrice': 0.5, 'P75': 0.75, 'P90': 0.9}
+SKETCH_ACCURACY = 0.01 # Relative error of the price quantiles
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY) # Ratio between sketch bucket bounds
+MIN_PRICE = 1.0 # Prices below this go in its bucket - the sketch needs them positive
+YEAR_ORIGIN = 2000 # Years are summed relative to this, to keep the sums of squares small
+BUILD_BATCH_SIZE = 10000 # Listings added to the cube at a time when built from an output file
+
+logger = logging.getLogger(__name__)
+
+# Every cube opened for reading in this process, by path - shared by every bokeh session
+cubes = {}
+cubesLock = threading.Lock()
+
+
+def priceBuckets(prices):
+    return np.ceil(np.log(np.maximum(prices, MIN_PRICE)) / math.log(SKETCH_GAMMA)).astype(np.int64)
+
+
+'''
+Price each sketch bucket stands for - within SKETCH_ACCURACY of every price in it
+'''
+def bucketPrices(buckets):
+    return 2 * np.power(SKETCH_GAMMA, buckets) / (SKETCH_GAMMA + 1)
+
+
+'''
+Least squares slope of y against x from the sums of a rollup - NAN with fewer than two x values
+'''
+def slope(count, sumX, sumXSq, sumXY, sumY):
+    variance = count * sumXSq - sumX * sumX
+    return (count * sumXY - sumX * sumY) / variance.where(variance > 1e-9 * count * count)
+
+
+'''
+Cells and price sketch rows of one batch of listings, for adding to the cube
+'''
+def batchAggregates(dfBatch):
+    dfKeys = pd.DataFrame({key: dfBatch[key].astype(str).to_numpy() for key in ['Make', 'Model', 'Fuel', 'Trans']})
+    dfKeys['Year'] = dfBatch['Year'].astype(np.int64).to_numpy()
+    dfKeys = dfKeys[CUBE_KEYS]
+    prices = dfBatch['Price'].to_numpy(dtype=np.float64)
+    miles = dfBatch['Miles'].to_numpy(dtype=np.float64)
+    years = dfKeys['Year'].to_numpy(dtype=np.float64) - YEAR_ORIGIN
+
+    dfValues = dfKeys.assign(Price=prices, Miles=miles, MilesSq=miles * miles, MilesPrice=miles * prices,
+                             YearRel=years, YearSq=years * years, YearPrice=years * prices)
+    dfCells = dfValues.groupby(CUBE_KEYS, sort=False).agg(Count=('Price', 'size'), SumPrice=('Price', 'sum'),
+                                                          SumMiles=('Miles', 'sum'), SumMilesSq=('MilesSq', 'sum'),
+                                                          SumMilesPrice=('MilesPrice', 'sum'), SumYear=('YearRel', 'sum'),
+                                                          SumYearSq=('YearSq', 'sum'), SumYearPrice=('YearPrice', 'sum'),
+                                                          MinMiles=('Miles', 'min'), MaxMiles=('Miles', 'max')).reset_index()
+    dfSketch = dfKeys.assign(Bucket=priceBuckets(prices)).groupby(CUBE_KEYS + ['Bucket'], sort=False).size()
+    return dfCells, dfSketch.rename('Count').reset_index()
+
+
+class StatsCube():
+
+        def __init__(self, path=STATS_CUBE_FILE):
+            self.path = path
+            self.lock = threading.Lock() # Shared by every bokeh session's thread
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS cells (Make TEXT, Model TEXT, Year INTEGER, Fuel TEXT, Trans TEXT,
+                                                  Count INTEGER, SumPrice REAL, SumMiles REAL, SumMilesSq REAL,
+                                                  SumMilesPrice REAL, SumYear REAL, SumYearSq REAL, SumYearPrice REAL,
+                                                  MinMiles REAL, MaxMiles REAL,
+                                                  PRIMARY KEY (Make, Model, Year, Fuel, Trans));
+                CREATE TABLE IF NOT EXISTS priceSketch (Make TEXT, Model TEXT, Year INTEGER, Fuel TEXT, Trans TEXT,
+                                                        Bucket INTEGER, Count INTEGER,
+                                                        PRIMARY KEY (Make, Model, Year, Fuel, Trans, Bucket));
+            """)
+
+
+        '''
+        Add a batch of listings (output columns) to the cube, in one transaction
+        '''
+        def update(self, dfBatch):
+            if dfBatch.shape[0] == 0:
+                return
+            dfCells, dfSketch = batchAggregates(dfBatch)
+            sums = ", ".join(column + " = " + column + " + excluded." + column for column in SUM_COLUMNS)
+            with self.lock, self.connection:
+                self.connection.executemany("""INSERT INTO cells VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                               ON CONFLICT (Make, Model, Year, Fuel, Trans) DO UPDATE SET """ + sums + """,
+                                               MinMiles = MIN(MinMiles, excluded.MinMiles),
+                                               MaxMiles = MAX(MaxMiles, excluded.MaxMiles)""",
+                                            [tuple(value.item() if hasattr(value, 'item') else value for value in row)
+                                             for row in dfCells.itertuples(index=False, name=None)])
+                self.connection.executemany("""INSERT INTO priceSketch VALUES (?, ?, ?, ?, ?, ?, ?)
+                                               ON CONFLICT (Make, Model, Year, Fuel, Trans, Bucket)
+                                               DO UPDATE SET Count = Count + excluded.Count""",
+                                            [tuple(value.item() if hasattr(value, 'item') else value for value in row)
+                                             for row in dfSketch.itertuples(index=False, name=None)])
+
+
+        def select(self, table, make=None, model=None):
+            conditions = []
+            params = []
+            for column, value in [('Make', make), ('Model', model)]:
+                if value is not None:
+                    conditions.append(column + " = ?")
+                    params.append(value)
+            where = " WHERE " + " AND ".join(conditions) if conditions else ""
+            with self.lock:
+                return pd.read_sql_query("SELECT * FROM " + table + where, self.connection, params=params)
+
+
+        '''
+        Statistics rolled up to the groupBy columns (any of CUBE_KEYS, or none for the whole
+        dataset), of one make and/or model or of all of them. One row per group, with its
+        Count, MeanPrice, MeanMiles, price quantiles (QUANTILES), PricePerMile,
+        DepreciationPerYear and the range of miles, MinMiles to MaxMiles. A quantile is the
+        price of the listing at that rank (the lower of the two in the middle for the median),
+        to within SKETCH_ACCURACY.
+        '''
+        def summary(self, groupBy=('Make', 'Model'), make=None, model=None):
+            groupBy = list(groupBy) or ['All']
+            dfCells = self.select("cells", make, model).assign(All="All")
+            dfSketch = self.select("priceSketch", make, model).assign(All="All")
+            if dfCells.shape[0] == 0:
+                return pd.DataFrame(columns=groupBy + ['Count', 'MeanPrice', 'MeanMiles'] + list(QUANTILES) +
+                                    ['PricePerMile', 'DepreciationPerYear', 'MinMiles', 'MaxMiles'])
+
+            dfGroups = dfCells.groupby(groupBy, sort=True)
+            sums = dfGroups[SUM_COLUMNS].sum()
+            dfSummary = pd.DataFrame({'Count': sums['Count'], 'MeanPrice': sums['SumPrice'] / sums['Count'],
+                                      'MeanMiles': sums['SumMiles'] / sums['Count']})
+            dfSketch = dfSketch.groupby(groupBy + ['Bucket'], sort=True)['Count'].sum().reset_index()
+            cumulative = dfSketch.groupby(groupBy, sort=False)['Count'].cumsum()
+            total = dfSketch.groupby(groupBy, sort=False)['Count'].transform('sum')
+            for name, quantile in QUANTILES.items():
+                dfReached = dfSketch[cumulative > quantile * (total - 1)]
+                dfSummary[name] = bucketPrices(dfReached.groupby(groupBy, sort=True)['Bucket'].first())
+            dfSummary['PricePerMile'] = slope(sums['Count'], sums['SumMiles'], sums['SumMilesSq'],
+                                              sums['SumMilesPrice'], sums['SumPrice'])
+            dfSummary['DepreciationPerYear'] = slope(sums['Count'], sums['SumYear'], sums['SumYearSq'],
+                                                     sums['SumYearPrice'], sums['SumPrice'])
+            dfSummary['MinMiles'] = dfGroups['MinMiles'].min()
+            dfSummary['MaxMiles'] = dfGroups['MaxMiles'].max()
+            dfSummary = dfSummary.reset_index()
+            return dfSummary if groupBy != ['All'] else dfSummary.drop(columns='All')
+
+
+        def close(self):
+            self.connection.close()
+
+
+'''
+The cube at path, opened on first use in this process - None if it hasn't been built
+'''
+def loadStatsCube(path=STATS_CUBE_FILE):
+    with cubesLock:
+        if path not in cubes:
+            cubes[path] = StatsCube(path) if os.path.exists(path) else None
+        return cubes[path]
+
+
+'''
+Output sink that builds the cube as the dataset is written, a batch at a time. Built in a
+temporary file and only replaces the previous cube when closed, as the other sinks do.
+'''
+class StatsCubeSink():
+
+        name = "stats"
+
+        def __init__(self, path=STATS_CUBE_FILE):
+            self.path = path
+            if os.path.exists(path + ".tmp"):
+                os.remove(path + ".tmp")
+            self.cube = StatsCube(path + ".tmp")
+
+
+        def write(self, dfBatch):
+            self.cube.update(dfBatch)
+
+
+        def close(self):
+            self.cube.close()
+            os.replace(self.path + ".tmp", self.path)
+
+
+'''
+Add every listing of an output file (pkl, or the Parquet dataset) to the cube at path - a
+new cube unless append
+'''
+def buildStatsCube(dataPath, path=STATS_CUBE_FILE, append=False):
+    from autoTraderDataLayer import readDataFile
+    dfAllData = readDataFile(dataPath)
+    if append:
+        cube = StatsCube(path)
+        for start in range(0, dfAllData.shape[0], BUILD_BATCH_SIZE):
+            cube.update(dfAllData.iloc[start:start + BUILD_BATCH_SIZE])
+        cube.close()
+    else:
+        sink = StatsCubeSink(path)
+        for start in range(0, dfAllData.shape[0], BUILD_BATCH_SIZE):
+            sink.write(dfAllData.iloc[start:start + BUILD_BATCH_SIZE])
+        sink.close()
+    logger.info("%d listings added to %s", dfAllData.shape[0], path)
+
+
+if __name__ == "__main__":
+    from autoTraderMetrics import configureLogging
+    argParser = argparse.ArgumentParser(description="Build the market statistics cube from a used car output file")
+    argParser.add_argument("data", help="output file to read - the pkl or the Parquet dataset directory")
+    argParser.add_argument("--cube", default=STATS_CUBE_FILE, help="cube file to write (default " + STATS_CUBE_FILE + ")")
+    argParser.add_argument("--append", action="store_true", help="add the listings to the cube already there")
+    args = argParser.parse_args()
+    configureLogging()
+    buildStatsCube(args.data, args.cube, args.append)
@@ -0,0 +1,292 @@
+import argparse
+import logging
+import os
+import re
+import socket
+import threading
+import time
+import pandas as pd
+from autoTraderCheckpoint import CheckpointStore, CHECKPOINT_FILE
+from autoTraderUsedCarScrape import (AutoTraderUsedCarScraper, scrapeMakeModel, writeCheckpointOutput, PROXIES,
+                                     PKL_READ_FILE, PKL_OUT_FILE, RESPONSE_CACHE)
+from autoTraderMetrics import (metrics, configureLogging, startMetricsServer, stopMetricsServer, LOG_LEVEL,
+                               METRICS_JSON_FILE)
+
+'''
+Coordinator/worker mode for the used car web scrape, so the make/models can be split over
+several machines.
+
+The coordinator puts every make/model of the make and model pkl into a tasks table in the
+checkpoint store (CHECKPOINT_FILE), which every node opens from a shared location. Workers
+claim one make/model at a time with a lease of LEASE_SECONDS, renewed every
+HEARTBEAT_SECONDS while the make/model is being scraped. Its listings and issues are written
+to the checkpoint store in the same transaction as the task is marked done, and only if the
+worker still holds the lease - so every make/model ends up in the store exactly once.
+
+If a worker dies its lease runs out and the make/model is claimed again by another worker.
+A make/model whose lease has run out MAX_ATTEMPTS times is given up on and logged as a
+"Lease Expired" issue. Once every task is done the coordinator writes the output files, the
+same as performUsedCarWebScrape, and the run can be resumed the same way.
+
+The store is SQLite, so the shared location must support file locking, and the nodes'
+clocks should be kept in sync for leases to run out on time. Pages within a make/model are
+still fetched concurrently by the worker that has claimed it.
+
+Start the coordinator first, then any number of workers:
+
+python autoTraderWorkQueue.py coordinator --store /shared/usedCarScrapeCheckpoint.db
+python autoTraderWorkQueue.py worker --store /shared/usedCarScrapeCheckpoint.db
+'''
+
+LEASE_SECONDS = 300 # A claimed make/model goes back in the queue if not renewed for this long
+HEARTBEAT_SECONDS = 60 # How often a worker renews the lease on the make/model it is scraping
+POLL_SECONDS = 10 # Wait between checks while other workers' make/models are still leased
+MAX_ATTEMPTS = 3 # Times a make/model can be claimed before it is logged as an issue instead
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+
+logger = logging.getLogger(__name__)
+
+
+class WorkQueue():
+
+        def __init__(self, path=CHECKPOINT_FILE):
+            self.checkpoint = CheckpointStore(path)
+            self.connection = self.checkpoint.connection
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS tasks (makeModelIndex INTEGER PRIMARY KEY, Make TEXT, Model TEXT, state TEXT,
+                                                  worker TEXT, leaseExpires REAL, attempts INTEGER);
+                CREATE INDEX IF NOT EXISTS tasksState ON tasks (state, makeModelIndex);
+            """)
+
+
+        '''
+        Queue every make/model in dfMakeModel. Returns how many are left to do.
+
+        Without resume the checkpoint store and any earlier run's tasks are cleared. With
+        resume the tasks already queued are kept, so make/models leased by workers that are
+        still running stay with them. Only make/models done with issues are queued again, and
+        any not queued yet are added - as done if they are checkpointed without issues.
+        '''
+        def enqueue(self, dfMakeModel, resume=False):
+            if resume:
+                completed = self.checkpoint.completedIndexes()
+            else:
+                self.checkpoint.clear()
+                completed = set()
+            tasks = [(int(index), row.iloc[0], row.iloc[1], DONE if index in completed else PENDING, None, None, 0)
+                     for index, row in dfMakeModel.iterrows()]
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE")
+                if resume:
+                    self.connection.execute("""UPDATE tasks SET state = ?, worker = NULL, leaseExpires = NULL, attempts = 0
+                                               WHERE state = ? AND makeModelIndex IN (SELECT makeModelIndex FROM issues)""",
+                                            (PENDING, DONE))
+                else:
+                    self.connection.execute("DELETE FROM tasks")
+                self.connection.executemany("INSERT OR IGNORE INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?)", tasks)
+                remaining = self.connection.execute("SELECT COUNT(*) FROM tasks WHERE state != ?", (DONE,)).fetchone()[0]
+            return remaining
+
+
+        '''
+        Lease the next make/model to worker - one never claimed, or one whose lease has run
+        out. Returns (makeModelIndex, make, model), or None if there is nothing to claim.
+        '''
+        def claim(self, worker, leaseSeconds=LEASE_SECONDS):
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE") # Hold the write lock so no other worker claims the same task
+                now = time.time()
+                self.giveUpAbandoned(now)
+                task = self.connection.execute("""SELECT makeModelIndex, Make, Model FROM tasks
+                                                  WHERE state = ? OR (state = ? AND leaseExpires < ?)
+                                                  ORDER BY makeModelIndex LIMIT 1""", (PENDING, LEASED, now)).fetchone()
+                if task is not None:
+                    self.connection.execute("""UPDATE tasks SET state = ?, worker = ?, leaseExpires = ?, attempts = attempts + 1
+                                               WHERE makeModelIndex = ?""", (LEASED, worker, now + leaseSeconds, task[0]))
+            return task
+
+
+        '''
+        Mark done, with a "Lease Expired" issue, every make/model whose lease has run out
+        MAX_ATTEMPTS times. Called within claim's transaction.
+        '''
+        def giveUpAbandoned(self, now):
+            abandoned = self.connection.execute("""SELECT makeModelIndex, Make, Model FROM tasks
+                                                   WHERE state = ? AND leaseExpires < ? AND attempts >= ?""",
+                                                (LEASED, now, MAX_ATTEMPTS)).fetchall()
+            for makeModelIndex, make, model in abandoned:
+                logger.warning("Giving up on %s %s - its lease ran out %d times", make, model, MAX_ATTEMPTS)
+                self.checkpoint.writeMakeModel(makeModelIndex, make, model, None,
+                                               [["Lease Expired", makeModelIndex, make, model]])
+                self.connection.execute("UPDATE tasks SET state = ?, leaseExpires = NULL WHERE makeModelIndex = ?",
+                                        (DONE, makeModelIndex))
+
+
+        '''
+        Extend worker's lease on a make/model. Returns False if the lease has been lost.
+        '''
+        def renew(self, worker, makeModelIndex, leaseSeconds=LEASE_SECONDS):
+            with self.connection:
+                cursor = self.connection.execute("""UPDATE tasks SET leaseExpires = ?
+                                                    WHERE makeModelIndex = ? AND worker = ? AND state = ?""",
+                                                 (time.time() + leaseSeconds, int(makeModelIndex), worker, LEASED))
+            return cursor.rowcount == 1
+
+
+        '''
+        Checkpoint a scraped make/model and mark its task done, in one transaction - only if
+        worker still holds its lease. Returns False, writing nothing, if another worker has
+        claimed it since.
+        '''
+        def complete(self, worker, makeModelIndex, make, model, dfIter, issues):
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE")
+                cursor = self.connection.execute("""UPDATE tasks SET state = ?, leaseExpires = NULL
+                                                    WHERE makeModelIndex = ? AND worker = ? AND state = ?""",
+                                                 (DONE, int(makeModelIndex), worker, LEASED))
+                if cursor.rowcount == 0:
+                    return False
+                self.checkpoint.writeMakeModel(makeModelIndex, make, model, dfIter, issues)
+            return True
+
+
+        '''
+        Number of tasks in each state
+        '''
+        def progress(self):
+            counts = dict(self.connection.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+            return {state: counts.get(state, 0) for state in [PENDING, LEASED, DONE]}
+
+
+        def close(self):
+            self.checkpoint.close()
+
+
+'''
+Renews a worker's lease on the make/model it is scraping, from a thread of its own, for as
+long as makeModelIndex is set.
+'''
+class LeaseHeartbeat():
+
+        def __init__(self, path, worker, interval=HEARTBEAT_SECONDS):
+            self.path = path
+            self.worker = worker
+            self.interval = interval
+            self.makeModelIndex = None
+            self.stopped = threading.Event()
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+
+        def run(self):
+            queue = WorkQueue(self.path) # SQLite connections can't be shared between threads
+            while not self.stopped.wait(self.interval):
+                makeModelIndex = self.makeModelIndex
+                if makeModelIndex is not None and not queue.renew(self.worker, makeModelIndex):
+                    logger.warning("Lost the lease on make/model %s to another worker", makeModelIndex)
+            queue.close()
+
+
+        def stop(self):
+            self.stopped.set()
+            self.thread.join()
+
+
+'''
+Queue every make/model for the workers, wait for them to finish, then write the output
+files from the checkpoint store.
+'''
+def runCoordinator(path=CHECKPOINT_FILE, resume=False):
+    dfMakeModel = pd.read_pickle(PKL_READ_FILE)
+    queue = WorkQueue(path)
+    logger.info("%d make/models queued for the workers in %s", queue.enqueue(dfMakeModel, resume), path)
+
+    while True:
+        counts = queue.progress()
+        logger.info("Pending: %d, being scraped: %d, done: %d", counts[PENDING], counts[LEASED], counts[DONE])
+        if counts[PENDING] == 0 and counts[LEASED] == 0:
+            break
+        time.sleep(POLL_SECONDS)
+
+    listings, deduplicator = writeCheckpointOutput(queue.checkpoint, PKL_OUT_FILE)
+    issues = queue.checkpoint.loadIssues()
+    queue.close()
+    logger.info("%d listings written, %d issues logged - run the coordinator again with --resume to retry them",
+                listings, len(issues))
+    if deduplicator is not None:
+        deduplicator.logStats()
+
+
+'''
+Claim and scrape make/models until there are none left, including any whose lease runs out
+while other workers are still going. Each worker writes its own metrics report, named after
+it, so workers sharing a directory don't overwrite each other's.
+'''
+def runWorker(path=CHECKPOINT_FILE, worker=None):
+    worker = worker or socket.gethostname() + ":" + str(os.getpid())
+    metrics.reset()
+    metricsServer = startMetricsServer()
+    webScraper = AutoTraderUsedCarScraper(PROXIES, PKL_READ_FILE, PKL_OUT_FILE)
+    webScraper.startParsePipeline()
+    if RESPONSE_CACHE:
+        webScraper.openResponseCache() # Each node keeps the pages it fetched
+    queue = WorkQueue(path)
+    heartbeat = LeaseHeartbeat(path, worker)
+    scraped = 0
+
+    while True:
+        task = queue.claim(worker)
+        if task is None:
+            counts = queue.progress()
+            if counts[PENDING] == 0 and counts[LEASED] == 0:
+                break
+            time.sleep(POLL_SECONDS) # Others' make/models may yet be given up on and need claiming
+            continue
+
+        makeModelIndex, make, model = task
+        heartbeat.makeModelIndex = makeModelIndex
+        dfIter, issues = scrapeMakeModel(webScraper, (makeModelIndex,), make, model)
+        heartbeat.makeModelIndex = None
+        with metrics.timer("checkpoint_write_seconds"):
+            completed = queue.complete(worker, makeModelIndex, make, model, dfIter, issues)
+        if completed:
+            scraped = scraped + 1
+        else:
+            logger.warning("Lease on %s %s was lost - its result is left to the worker now scraping it", make, model)
+
+    heartbeat.stop()
+    queue.close()
+    webScraper.session.close()
+    webScraper.stopParsePipeline()
+    webScraper.closeResponseCache()
+    logger.info("Worker %s scraped %d make/models", worker, scraped)
+    webScraper.session.logBlockStats()
+    if webScraper.proxyPool is not None:
+        webScraper.proxyPool.logStats()
+    metrics.writeReport(workerMetricsFile(worker), run="worker", worker=worker, makeModelsScraped=scraped)
+    stopMetricsServer(metricsServer)
+
+
+def workerMetricsFile(worker):
+    base, extension = os.path.splitext(METRICS_JSON_FILE)
+    return base + "." + re.sub(r"[^\w.-]", "_", worker) + extension
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Split the used car web scrape over several machines through a shared work queue")
+    argParser.add_argument("role", choices=["coordinator", "worker"])
+    argParser.add_argument("--store", default=CHECKPOINT_FILE,
+                           help="checkpoint store holding the work queue - a path every node can reach")
+    argParser.add_argument("--resume", action="store_true",
+                           help="coordinator only - queue only the make/models the last run didn't finish without issues")
+    argParser.add_argument("--name", default=None, help="worker only - name to claim make/models under (default host:pid)")
+    argParser.add_argument("--log-level", default=LOG_LEVEL, choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                           help="DEBUG also logs every page (default " + LOG_LEVEL + ")")
+    args = argParser.parse_args()
+    configureLogging(args.log_level)
+    if args.role == "coordinator":
+        runCoordinator(args.store, resume=args.resume)
+    else:
+        runWorker(args.store, worker=args.name)
@@ -0,0 +1,91 @@
+import random
+
+'''
+Synthetic AutoTrader search result pages for offline benchmarking.
+
+Pages follow the same simplified HTML structure documented in autoTraderUsedCarScrape.py
+(information-container cards with a listing-key-specs list, plus a vehicle-price), and
+include the awkward key-spec cases the attribute rules have to deal with, e.g. Limousine
+body types, letter registrations and listings with specs missing.
+'''
+
+LISTINGS_PER_PAGE = 12
+MAKES_MODELS = [("Audi", "A4 Avant"), ("BMW", "X5"), ("Ford", "Fiesta"), ("Jeep", "Grand Cherokee"),
+                ("Nissan", "Qashqai"), ("Volkswagen", "Golf"), ("Lincoln", "Town Car"), ("Dacia", "Sandero")]
+BODY_TYPES = ["SUV", "Hatchback", "Saloon", "Estate", "Convertible", "Coupe", "Limousine", "MPV"]
+TRANSMISSIONS = ["Manual", "Automatic"]
+FUELS = ["Petrol", "Diesel", "Petrol Hybrid", "Electric"]
+
+
+'''
+Key specs for one listing - some listings deliberately miss specs so NAN handling is exercised
+'''
+def makeKeySpecs(rng):
+    year = rng.randint(1985, 2020)
+    if year < 2001 and rng.random() < 0.5:
+        regYear = str(year) + " (" + rng.choice("LMNPRSTVWXY") + " reg)"
+    elif rng.random() < 0.2:
+        regYear = str(year) # Year with no reg, e.g. imports
+    else:
+        regYear = str(year) + " (" + str(year)[2:] + " reg)"
+
+    specs = [regYear,
+             rng.choice(BODY_TYPES),
+             "{:,}".format(rng.randint(5, 180000)) + " miles",
+             "{:.1f}L".format(rng.choice([0.9, 1.0, 1.2, 1.4, 1.6, 2.0, 3.0, 4.4])),
+             str(rng.randint(60, 600)) + "bhp",
+             rng.choice(TRANSMISSIONS),
+             rng.choice(FUELS)]
+    for spec in list(specs[2:]):
+        if rng.random() < 0.05:
+            specs.remove(spec)
+    return specs
+
+
+'''
+HTML for one listing card and its price
+'''
+def makeListing(rng, make, model, advertId):
+    specs = makeKeySpecs(rng)
+    price = rng.randint(500, 90000)
+    specItems = "\n".join("<li>" + spec + "</li>" for spec in specs) # The website does not indent these
+    return ('<li class="search-page__result" id="' + str(advertId) + '">\n'
+            '<article data-standout-type="" id="' + str(advertId) + '" class="search-listing">\n'
+            '    <div class="information-container">\n'
+            '        <h2 class="listing-title title-wrap">\n'
+            '            <a class="js-click-handler listing-fpa-link tracking-standard-link" href="/car-details/' + str(advertId) + '">' +
+            make + ' ' + model + ' ' + str(rng.randint(1, 9)) + '.' + str(rng.randint(0, 9)) + ' Sport ' + str(rng.choice([3, 5])) + 'dr</a>\n'
+            '        </h2>\n'
+            '        <p class="listing-attention-grabber ">**FULL SERVICE HISTORY**</p>\n'
+            '        <ul class="listing-key-specs ">\n' + specItems + '\n'
+            '        </ul>\n'
+            '    </div>\n'
+            '    <section class="price-column">\n'
+            '        <a class="js-click-handler listing-fpa-link listings-price-link tracking-standard-link" href="/car-details/' + str(advertId) + '">\n'
+            '            <div data-label="search appearance click" class="vehicle-price">£' + "{:,}".format(price) + '</div>\n'
+            '        </a>\n'
+            '    </section>\n'
+            '</article>\n'
+            '</li>\n')
+
+
+'''
+A full search result page as a str. pageNum and totalResults are written into the result
+count and pagination the same way the website does.
+'''
+def makeSearchPage(pageNum, listings=LISTINGS_PER_PAGE, seed=0, totalResults=None, make=None, model=None):
+    rng = random.Random(seed * 100003 + pageNum)
+    if make is None:
+        make, model = rng.choice(MAKES_MODELS)
+    if totalResults is None:
+        totalResults = listings * pageNum
+    pageCount = max(1, -(-totalResults // LISTINGS_PER_PAGE))
+
+    cards = "".join(makeListing(rng, make, model, 201900000000000 + seed * 100000 + pageNum * 100 + i) for i in range(listings))
+    return ('<!DOCTYPE html>\n<html lang="en">\n<head><title>Used ' + make + ' ' + model + ' for sale | AutoTrader</title></head>\n<body>\n'
+            '<h1 class="search-form__count js-results-count">' + "{:,}".format(totalResults) + ' cars found</h1>\n'
+            '<ul class="search-page__results">\n' + cards + '</ul>\n'
+            '<ul class="pagination">\n'
+            '    <li class="paginationMini__count">Page <strong>' + str(pageNum) + '</strong> of <strong>' + str(pageCount) + '</strong></li>\n'
+            '</ul>\n'
+            '</body>\n</html>\n')
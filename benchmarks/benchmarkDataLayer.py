@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from benchmarkOutputStore import makeDataset
+from autoTraderDataLayer import loadDataset
+
+'''
+Benchmark of bokeh session startup with the shared data layer (autoTraderDataLayer.py)
+against loading the pkl in every session, as bokehServerAutoTrader.py used to.
+
+For datasets of increasing size, a fresh process stands in for a new session and reports
+the time and memory (RSS) it takes to get from nothing to the rows of one make/model:
+
+    pkl        - read_pickle and astype(float) the whole dataset, then filter
+    data layer - memory map the Arrow file and read the make/model's rows
+
+The Arrow file is built beforehand, as it is by the first session after a new data file.
+A session after the first in the same process skips even the memory map.
+
+RSS is read from /proc, so this needs Linux.
+
+To run from the repo root:
+
+python benchmarks/benchmarkDataLayer.py
+'''
+
+ROW_COUNTS = [100000, 1000000, 3000000]
+
+SESSION_SCRIPT = """
+import sys, time
+sys.path.insert(0, {repoDir!r})
+import pandas as pd
+import autoTraderDataLayer
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * 4096
+
+before = rss()
+start = time.perf_counter()
+if sys.argv[1] == "pkl":
+    dfOnline = pd.read_pickle(sys.argv[2])
+    for column in ['Price', 'Year', 'Miles', 'BHP', 'L']:
+        dfOnline[column] = dfOnline[column].astype(float)
+    rows = dfOnline[(dfOnline.Make == "Make0") & (dfOnline.Model == "Model 0")]
+else:
+    rows = autoTraderDataLayer.loadDataset(sys.argv[2]).rows("Make0", "Model 0")
+print(time.perf_counter() - start, rss() - before, len(rows))
+"""
+
+
+def runSession(mode, dataPath):
+    repoDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    output = subprocess.check_output([sys.executable, "-c", SESSION_SCRIPT.format(repoDir=repoDir), mode, dataPath])
+    elapsed, rssGrowth, rowCount = output.split()
+    return float(elapsed), int(rssGrowth), int(rowCount)
+
+
+def benchmarkDataLayer():
+    print("Rows       pkl: start (s)   RSS (MB)   |   data layer: start (s)   RSS (MB)   |   build Arrow file (s)")
+    for rowCount in ROW_COUNTS:
+        with tempfile.TemporaryDirectory() as dataDir:
+            dataPath = os.path.join(dataDir, "dataset.pkl")
+            makeDataset(rowCount).to_pickle(dataPath)
+            start = time.perf_counter()
+            loadDataset(dataPath)
+            buildTime = time.perf_counter() - start
+
+            pklTime, pklRss, pklRows = runSession("pkl", dataPath)
+            layerTime, layerRss, layerRows = runSession("layer", dataPath)
+            if pklRows != layerRows:
+                raise AssertionError("Data layer gave " + str(layerRows) + " rows, the pkl " + str(pklRows))
+            print("%7d   %14.3f   %8.1f   |   %21.4f   %8.1f   |   %20.2f"
+                  % (rowCount, pklTime, pklRss / 1e6, layerTime, layerRss / 1e6, buildTime))
+
+
+if __name__ == "__main__":
+    benchmarkDataLayer()
@@ -0,0 +1,44 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from autoTraderUsedCarScrape import AutoTraderUsedCarScraper
+from autoTraderFixtures import makeSearchPage, LISTINGS_PER_PAGE
+
+'''
+Benchmark of AutoTraderUsedCarScraper.extractAttributes against the number of listings.
+
+The pages are parsed up front with the scraper's parser backend so only attribute extraction
+(extractPageColumns per page, then extractAttributes) is timed. If its cost is linear in the
+number of listings, the time per listing should stay flat as the page count grows.
+
+To run from the repo root:
+
+python benchmarks/benchmarkExtractAttributes.py
+'''
+
+PAGE_COUNTS = [25, 50, 100, 200, 400]
+REPEATS = 3
+
+
+def benchmarkExtractAttributes():
+    webScraper = AutoTraderUsedCarScraper(None, None, None)
+    pages = [webScraper.parser.parse(makeSearchPage(i + 1).encode('utf-8')) for i in range(max(PAGE_COUNTS))]
+
+    print("Pages   Listings   Best time (s)   us per listing")
+    for pageCount in PAGE_COUNTS:
+        soupSet = pages[:pageCount]
+        best = None
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            webScraper.extractAttributes([webScraper.extractPageColumns(soup) for soup in soupSet])
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        listings = pageCount * LISTINGS_PER_PAGE
+        print("%5d   %8d   %13.3f   %14.1f" % (pageCount, listings, best, best / listings * 1e6))
+    webScraper.session.close()
+
+
+if __name__ == "__main__":
+    benchmarkExtractAttributes()
@@ -0,0 +1,92 @@
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from autoTraderLevelOfDetail import levelOfDetail, dataWindow, LOD_THRESHOLD
+
+'''
+Benchmark of the level of detail view (autoTraderLevelOfDetail.py) used by
+bokehServerAutoTrader.py, against sending every point of a selection.
+
+For selections of increasing size, with the same columns as the bokeh app's data source,
+reports what is sent to the browser for the full view and for a view zoomed in on a small
+part of the plot: how many glyphs the browser has to draw, the payload size, and the server
+time to work out the view. The browser's render time grows with the glyphs it draws.
+
+Payload size is estimated as bokeh sends it - numeric numpy columns as base64 encoded binary,
+everything else (names, colors, ...) as JSON lists.
+
+To run from the repo root:
+
+python benchmarks/benchmarkLevelOfDetail.py
+'''
+
+POINT_COUNTS = [1000, 5000, 20000, 100000, 500000]
+ZOOM_FRACTION = 0.05 # Zoomed view covers this fraction of each axis
+REPEATS = 3
+
+
+def makeFigureData(pointCount, seed=0):
+    rng = np.random.default_rng(seed)
+    miles = rng.gamma(2.0, 25000.0, pointCount)
+    price = np.maximum(500.0, 30000.0 * np.exp(-miles / 60000.0) + rng.normal(0, 3000, pointCount))
+    return dict(x=miles,
+                y=price,
+                color=rng.choice(np.array(["#3182bd", "#6baed6", "#9ecae1"], dtype=object), pointCount),
+                size=rng.choice(np.array(list(range(10, 30, 3))), pointCount),
+                argName=np.array(["Audi A4 Avant 2.0 TDI S line 5dr"] * pointCount, dtype=object),
+                argPrice=price,
+                argYear=rng.integers(1990, 2021, pointCount).astype(float),
+                argMiles=miles,
+                argBHP=rng.integers(60, 600, pointCount).astype(float),
+                argL=rng.choice([1.0, 1.6, 2.0, 3.0], pointCount),
+                argTrans=rng.choice(np.array(["Manual", "Automatic"], dtype=object), pointCount))
+
+
+def payloadBytes(columns):
+    total = 0
+    for values in columns.values():
+        if values.dtype.kind in 'fiu':
+            total = total + -(-values.nbytes // 3) * 4 # base64
+        else:
+            total = total + len(json.dumps(values.tolist()))
+    return total
+
+
+def measureView(data, window):
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        points, density = levelOfDetail(data, window)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    glyphs = len(points['x']) + len(density['x'])
+    return glyphs, payloadBytes(points) + payloadBytes(density), best
+
+
+def benchmarkLevelOfDetail():
+    print("LOD_THRESHOLD: " + str(LOD_THRESHOLD) + " points, zoomed view covers " + str(ZOOM_FRACTION * 100) + "% of each axis")
+    print("Points    View     All points: glyphs   payload (KB)   |   Level of detail: glyphs   payload (KB)   server (ms)")
+    for pointCount in POINT_COUNTS:
+        data = makeFigureData(pointCount)
+        xStart, xEnd, yStart, yEnd = dataWindow(data['x'], data['y'])
+        xMid = np.median(data['x'])
+        yMid = np.median(data['y'])
+        zoomWindow = (xMid - (xEnd - xStart) * ZOOM_FRACTION / 2, xMid + (xEnd - xStart) * ZOOM_FRACTION / 2,
+                      yMid - (yEnd - yStart) * ZOOM_FRACTION / 2, yMid + (yEnd - yStart) * ZOOM_FRACTION / 2)
+        for viewName, window in [("full", None), ("zoomed", zoomWindow)]:
+            if window is None:
+                allPoints = data
+            else:
+                visible = (data['x'] >= window[0]) & (data['x'] <= window[1]) & (data['y'] >= window[2]) & (data['y'] <= window[3])
+                allPoints = {column: values[visible] for column, values in data.items()}
+            glyphs, payload, elapsed = measureView(data, window)
+            print("%6d   %-6s   %18d   %12.1f   |   %22d   %12.1f   %11.2f"
+                  % (pointCount, viewName, len(allPoints['x']), payloadBytes(allPoints) / 1e3, glyphs, payload / 1e3, elapsed * 1e3))
+
+
+if __name__ == "__main__":
+    benchmarkLevelOfDetail()
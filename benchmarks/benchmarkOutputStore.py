@@ -0,0 +1,109 @@
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from autoTraderOutputStore import writeParquet, readParquet
+
+'''
+Benchmark of the Parquet output (autoTraderOutputStore.py) against the pkl and csv pair the
+scraper has always written.
+
+A synthetic dataset of ROWS listings shaped like the scraper output (MAKES makes with
+MODELS_PER_MAKE models each) is written in each format, then loaded back in full and for
+a single make/model. The pkl and csv have to be loaded in full and filtered; the Parquet
+read pushes the make/model filter down. Reports file size, write time and load times.
+
+To run from the repo root:
+
+python benchmarks/benchmarkOutputStore.py
+'''
+
+ROWS = 500000
+MAKES = 40
+MODELS_PER_MAKE = 12
+REPEATS = 3
+
+
+def makeDataset(rows=ROWS, seed=0):
+    rng = np.random.default_rng(seed)
+    makes = np.array(["Make" + str(i) for i in range(MAKES)], dtype=object)
+    makeIndex = rng.integers(0, MAKES, rows)
+    modelIndex = rng.integers(0, MODELS_PER_MAKE, rows)
+    models = np.array(["Model " + str(i) for i in range(MAKES * MODELS_PER_MAKE)], dtype=object)
+    trims = np.array(["1.0 SE 5dr", "2.0 TDI S line 5dr", "1.6 Sport 3dr", "3.0 V6 quattro 4dr"], dtype=object)
+    dfAllData = pd.DataFrame({'Make': makes[makeIndex],
+                              'Model': models[makeIndex * MODELS_PER_MAKE + modelIndex],
+                              'Name': makes[makeIndex] + " " + trims[rng.integers(0, len(trims), rows)],
+                              'Price': rng.integers(500, 90000, rows).astype(float),
+                              'Year': rng.integers(1985, 2021, rows).astype(float),
+                              'Miles': rng.integers(5, 180000, rows).astype(float),
+                              'BHP': rng.integers(60, 600, rows).astype(float),
+                              'L': rng.choice([1.0, 1.2, 1.6, 2.0, 3.0], rows),
+                              'Trans': rng.choice(np.array(["Manual", "Automatic"], dtype=object), rows),
+                              'Fuel': rng.choice(np.array(["Petrol", "Diesel", "Petrol Hybrid"], dtype=object), rows)})
+    # Same order as the scraper output - grouped by make/model
+    return dfAllData.sort_values(['Make', 'Model'], kind='stable').reset_index(drop=True)
+
+
+def pathSize(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, names in os.walk(path) for name in names)
+
+
+def bestTime(function):
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def benchmarkOutputStore():
+    dfAllData = makeDataset()
+    make, model = dfAllData.Make.iloc[0], dfAllData.Model.iloc[0]
+    expectedRows = int(((dfAllData.Make == make) & (dfAllData.Model == model)).sum())
+
+    with tempfile.TemporaryDirectory() as outDir:
+        pklPath = os.path.join(outDir, "output.pkl")
+        csvPath = os.path.join(outDir, "output.csv")
+        parquetPath = os.path.join(outDir, "output.parquet")
+        formats = [("pkl", pklPath,
+                    lambda: dfAllData.to_pickle(pklPath),
+                    lambda: pd.read_pickle(pklPath),
+                    lambda: (lambda df: df[(df.Make == make) & (df.Model == model)])(pd.read_pickle(pklPath))),
+                   ("csv", csvPath,
+                    lambda: dfAllData.to_csv(csvPath),
+                    lambda: pd.read_csv(csvPath, index_col=0),
+                    lambda: (lambda df: df[(df.Make == make) & (df.Model == model)])(pd.read_csv(csvPath, index_col=0))),
+                   ("parquet", parquetPath,
+                    lambda: writeParquet(dfAllData, parquetPath),
+                    lambda: readParquet(parquetPath),
+                    lambda: readParquet(parquetPath, make=make, model=model))]
+
+        print("Dataset: " + str(dfAllData.shape[0]) + " listings, " + str(MAKES * MODELS_PER_MAKE) + " make/models, "
+              + str(expectedRows) + " listings in the make/model loaded on its own")
+        print("Format    Size (MB)   Write (s)   Load all (s)   Load one model (s)")
+        for name, path, write, loadAll, loadOne in formats:
+            writeTime, _ = bestTime(write)
+            loadAllTime, dfAll = bestTime(loadAll)
+            loadOneTime, dfOne = bestTime(loadOne)
+            if dfAll.shape[0] != dfAllData.shape[0] or dfOne.shape[0] != expectedRows:
+                raise AssertionError(name + " did not load back the rows written")
+            print("%-7s   %9.1f   %9.3f   %12.3f   %18.4f" % (name, pathSize(path) / 1e6, writeTime, loadAllTime, loadOneTime))
+
+        # The Parquet schema is narrower, but must hold the same values
+        dfParquet = readParquet(parquetPath).astype({'Price': float, 'Year': float, 'Miles': float, 'BHP': float})
+        for column in ['Make', 'Model', 'Name', 'Price', 'Year', 'Miles', 'BHP', 'Trans', 'Fuel']:
+            if not (dfParquet[column].astype(object).to_numpy() == dfAllData[column].to_numpy()).all():
+                raise AssertionError("Parquet output changed the " + column + " column")
+
+
+if __name__ == "__main__":
+    benchmarkOutputStore()
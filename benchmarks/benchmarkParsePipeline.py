@@ -0,0 +1,67 @@
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from autoTraderUsedCarScrape import AutoTraderUsedCarScraper, PARSE_QUEUE_SIZE
+from autoTraderPipeline import ParsePipeline
+
+'''
+Benchmark of the process pool parsing stage (autoTraderPipeline.py) on the saved search
+pages in benchmarks/fixtures.
+
+The fixtures are repeated up to PAGES pages and pushed through a ParsePipeline with an
+increasing number of worker processes. Throughput should scale close to linearly until
+the worker count reaches the number of cores. "0 workers" is parsing in this process, as
+the scraper does with PARSE_WORKERS = 0.
+
+To run from the repo root:
+
+python benchmarks/benchmarkParsePipeline.py
+'''
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PAGES = 600
+
+
+def loadPages():
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.html"))):
+        with open(path, "rb") as f:
+            fixtures.append(f.read())
+    return [fixtures[i % len(fixtures)] for i in range(PAGES)]
+
+
+def benchmarkParsePipeline():
+    pages = loadPages()
+    webScraper = AutoTraderUsedCarScraper(None, None, None)
+    cores = os.cpu_count() or 1
+    workerCounts = sorted(set([1, 2, 4, 8, cores]))
+    workerCounts = [workers for workers in workerCounts if workers <= cores]
+
+    start = time.perf_counter()
+    expected = [webScraper.parsePage(content) for content in pages]
+    baseline = time.perf_counter() - start
+    dfExpected = webScraper.extractAttributes([pageColumns for pageColumns, pageCount in expected])
+
+    print("Parser backend: " + webScraper.parser.name + ", cores: " + str(cores) + ", pages: " + str(len(pages)))
+    print("Workers   Pages/sec   Speedup")
+    print("%7d   %9.1f   %6.2fx" % (0, len(pages) / baseline, 1.0))
+    for workers in workerCounts:
+        pipeline = ParsePipeline(workers, PARSE_QUEUE_SIZE, webScraper.parser.name)
+        pipeline.submit(pages[0]).result() # Start the worker processes before timing
+        start = time.perf_counter()
+        futures = [pipeline.submit(content) for content in pages]
+        results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+        pipeline.close()
+        dfResults = webScraper.extractAttributes([pageColumns for pageColumns, pageCount in results])
+        if not dfResults.equals(dfExpected) or [r[1] for r in results] != [e[1] for e in expected]:
+            raise AssertionError("Parse pipeline with " + str(workers) + " workers gave different results")
+        print("%7d   %9.1f   %6.2fx" % (workers, len(pages) / elapsed, baseline / elapsed))
+    webScraper.session.close()
+
+
+if __name__ == "__main__":
+    benchmarkParsePipeline()
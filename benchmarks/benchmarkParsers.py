@@ -0,0 +1,89 @@
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from autoTraderParsers import PARSERS
+
+'''
+Benchmark of the HTML parser backends in autoTraderParsers.py on the saved search pages
+in benchmarks/fixtures.
+
+Each backend parses the raw bytes of every fixture and extracts its listings, as the scraper
+does per page. The listings extracted by every backend are checked to be identical to the
+BeautifulSoup ones before any timings are reported - on the fixtures, and on copies of the
+first fixture with accented names in each of ENCODINGS, so every backend is also checked to
+read pages that are not utf-8 the same way.
+
+To run from the repo root:
+
+python benchmarks/benchmarkParsers.py
+'''
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+REPEATS = 20
+# Encodings the first fixture is re-saved in, and the charset declaration (if any) added to its head
+ENCODINGS = [("windows-1252", '<meta charset="windows-1252">'),
+             ("iso-8859-1", '<meta http-equiv="Content-Type" content="text/html; charset=iso-8859-1">'),
+             ("windows-1252", ''),
+             ("utf-8", '')]
+
+
+def loadFixtures():
+    pages = []
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.html"))):
+        with open(path, "rb") as f:
+            pages.append(f.read())
+    return pages
+
+
+'''
+Copies of a fixture with accented car names, saved in each of ENCODINGS
+'''
+def encodedPages(content):
+    text = content.decode('utf-8').replace("Audi", "Citroën Café")
+    return [text.replace("<head>", "<head>" + declaration).encode(encoding) for encoding, declaration in ENCODINGS]
+
+
+def parseAll(parser, pages):
+    return [parser.extractListings(parser.parse(content)) for content in pages]
+
+
+def benchmarkParsers():
+    pages = loadFixtures()
+    listingCount = sum(len(listings[0]) for listings in parseAll(PARSERS["bs4"](), pages))
+    expected = parseAll(PARSERS["bs4"](), pages)
+    encoded = encodedPages(pages[0])
+    expectedEncoded = parseAll(PARSERS["bs4"](), encoded)
+    if any("Citroën Café" not in listings[0][0] for listings in expectedEncoded):
+        raise AssertionError("bs4 did not read the re-encoded fixtures correctly")
+
+    print("Fixtures: " + str(len(pages)) + " pages, " + str(listingCount) + " listings")
+    print("Backend   Pages/sec   Listings/sec   Speedup")
+    baseline = None
+    for name in ["bs4", "lxml"]:
+        try:
+            parser = PARSERS[name]()
+        except ImportError as e:
+            print("%-7s   skipped - %s" % (name, e))
+            continue
+        if parseAll(parser, pages) != expected:
+            raise AssertionError(name + " backend does not extract the same listings as bs4")
+        for (encoding, declaration), listings, expectedListings in zip(ENCODINGS, parseAll(parser, encoded), expectedEncoded):
+            if listings != expectedListings:
+                raise AssertionError("%s backend does not extract the same listings as bs4 from a %s page%s" %
+                                     (name, encoding, "" if declaration else " with no charset"))
+
+        best = None
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            parseAll(parser, pages)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        baseline = best if baseline is None else baseline
+        print("%-7s   %9.1f   %12.1f   %6.1fx" % (name, len(pages) / best, listingCount / best, baseline / best))
+
+
+if __name__ == "__main__":
+    benchmarkParsers()
@@ -0,0 +1,77 @@
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from autoTraderOutputStore import SqliteSink
+from autoTraderQuery import ListingQuery
+from benchmarkOutputStore import makeDataset, bestTime
+
+'''
+Benchmark of the indexed SQLite queries (autoTraderQuery.py) against loading the pkl and
+filtering it with pandas, as every analysis of the dataset used to.
+
+A synthetic dataset of ROWS listings is written as a pkl and through the SQLite output sink.
+Each of QUERIES is then answered both ways - the first page of PAGE_SIZE results, and every
+result paged through - and the results checked to be the same. The pandas times include
+loading the pkl, which every separate job or bokeh session had to do.
+
+To run from the repo root:
+
+python benchmarks/benchmarkQuery.py
+'''
+
+ROWS = 500000
+PAGE_SIZE = 100
+QUERIES = {
+    "Diesel automatics under 15k, under 60k miles": dict(Fuel="Diesel", Trans="Automatic",
+                                                        Price=(None, 15000), Miles=(None, 60000)),
+    "One make/model": dict(Make="Make7", Model="Model 90"),
+    "2018 on, 300 BHP and up": dict(Year=(2018, None), BHP=(300, None)),
+    "Everything": dict(),
+}
+
+
+def pandasQuery(dfAllData, filters):
+    mask = pd.Series(True, index=dfAllData.index)
+    for column, value in filters.items():
+        if isinstance(value, tuple):
+            low, high = value
+            if low is not None:
+                mask = mask & (dfAllData[column] >= low)
+            if high is not None:
+                mask = mask & (dfAllData[column] < high)
+        else:
+            mask = mask & (dfAllData[column] == value)
+    return dfAllData[mask]
+
+
+def benchmarkQuery():
+    with tempfile.TemporaryDirectory() as scratch:
+        dfAllData = makeDataset(ROWS)
+        pklPath = os.path.join(scratch, "out.pkl")
+        dbPath = os.path.join(scratch, "out.db")
+        dfAllData.to_pickle(pklPath)
+        start = time.perf_counter()
+        sink = SqliteSink(dbPath)
+        sink.write(dfAllData)
+        sink.close()
+        print("%d listings - SQLite output written and indexed in %.1f s" % (ROWS, time.perf_counter() - start))
+        query = ListingQuery(dbPath)
+
+        print("Query                                            Matches   pkl + pandas (ms)   first page (ms)   all pages (ms)")
+        for name, filters in QUERIES.items():
+            pandasTime, dfExpected = bestTime(lambda: pandasQuery(pd.read_pickle(pklPath), filters).reset_index(drop=True))
+            pageTime, page = bestTime(lambda: query.page(PAGE_SIZE, **filters))
+            allTime, pages = bestTime(lambda: list(query.iterPages(PAGE_SIZE * 100, **filters)))
+            dfPaged = pd.concat(pages or [dfExpected.iloc[:0]], ignore_index=True)
+            assert dfPaged.equals(dfExpected[dfPaged.columns]), name
+            print("%-48s %7d   %17.1f   %15.2f   %14.1f" % (name, dfExpected.shape[0], pandasTime * 1000,
+                                                            pageTime * 1000, allTime * 1000))
+        query.close()
+
+
+if __name__ == "__main__":
+    benchmarkQuery()
@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from autoTraderUsedCarScrape import AutoTraderUsedCarScraper, scrapeMakeModel
+import autoTraderResponseCache
+from autoTraderFixtures import makeSearchPage
+
+'''
+Benchmark of rebuilding the dataset from the response cache (autoTraderResponseCache.py)
+with --replay, rather than fetching every page again.
+
+A cache is filled with MAKE_MODELS generated make/models of PAGES_PER_MAKE_MODEL pages each,
+as a crawl would leave it, then every make/model is replayed through scrapeMakeModel - the
+same extract and format steps as a live run - parsing in this process and with a pool of
+parse workers. Reports the size of the cache against the raw pages and the replay
+throughput - a live crawl at MAX_REQUESTS_PER_SECOND = 4 manages 4 pages per second.
+
+To run from the repo root:
+
+python benchmarks/benchmarkReplay.py
+'''
+
+MAKE_MODELS = 100
+PAGES_PER_MAKE_MODEL = 10
+PARSE_WORKER_COUNTS = [0, 4]
+
+
+def fillCache(cachePath, webScraper):
+    cache = autoTraderResponseCache.ResponseCache(cachePath)
+    for i in range(MAKE_MODELS):
+        fullURL = webScraper.urlModelCreate("Make" + str(i), "Model" + str(i))
+        for pageNum in range(1, PAGES_PER_MAKE_MODEL + 1):
+            page = makeSearchPage(pageNum, seed=i, totalResults=PAGES_PER_MAKE_MODEL * 12,
+                                  make="Make" + str(i), model="Model" + str(i))
+            cache.put(fullURL + str(pageNum), page.encode())
+    return cache
+
+
+def benchmarkReplay():
+    with tempfile.TemporaryDirectory() as cachePath:
+        cache = fillCache(cachePath, AutoTraderUsedCarScraper(None, None, None))
+        codec = "zstd" if autoTraderResponseCache.zstandard is not None else "zlib"
+        print("Cache (" + codec + "): " + str(cache.pagesStored) + " urls, " + str(round(cache.bytesIn / 1e6, 1)) + " MB raw, "
+              + str(round(cache.bytesStored / 1e6, 2)) + " MB on disk")
+        cache.close()
+
+        pages = MAKE_MODELS * PAGES_PER_MAKE_MODEL
+        print("Parse workers   Replay (s)   Pages per second   Listings")
+        for workers in PARSE_WORKER_COUNTS:
+            webScraper = AutoTraderUsedCarScraper(None, None, None)
+            webScraper.startParsePipeline(workers)
+            webScraper.openResponseCache(cachePath, replay=True)
+            listings = 0
+            start = time.perf_counter()
+            for i in range(MAKE_MODELS):
+                dfIter, issues = scrapeMakeModel(webScraper, (i,), "Make" + str(i), "Model" + str(i))
+                if issues:
+                    raise AssertionError("Replay logged issues: " + str(issues))
+                listings = listings + dfIter.shape[0]
+            elapsed = time.perf_counter() - start
+            webScraper.stopParsePipeline()
+            webScraper.responseCache.close()
+            print("%13d   %10.2f   %16.0f   %8d" % (workers, elapsed, pages / elapsed, listings))
+
+
+if __name__ == "__main__":
+    benchmarkReplay()
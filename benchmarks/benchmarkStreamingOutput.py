@@ -0,0 +1,64 @@
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from autoTraderCheckpoint import CheckpointStore
+from autoTraderOutputStore import openSinks, writeOutput, OUTPUT_BATCH_SIZE
+from benchmarkOutputStore import makeDataset
+
+'''
+Benchmark of writing the output files by streaming batches out of the checkpoint store
+(autoTraderOutputStore.py writeOutput) against loading every listing into one df and
+writing that, as the scraper used to.
+
+For checkpoint stores of increasing size, reports the peak memory allocated while the csv,
+Parquet and SQLite output is written each way. Streamed, the peak should stay about the
+same however many listings there are. Memory is measured with tracemalloc, which sees
+pandas and numpy allocations but not pyarrow's own memory pool.
+
+To run from the repo root:
+
+python benchmarks/benchmarkStreamingOutput.py
+'''
+
+ROW_COUNTS = [25000, 100000, 400000]
+SINKS = ["csv", "parquet", "sqlite"] # "pkl" keeps everything in memory either way
+
+
+def fillCheckpoint(path, rows):
+    checkpoint = CheckpointStore(path)
+    dfAllData = makeDataset(rows)
+    with checkpoint.connection:
+        for makeModelIndex, ((make, model), dfIter) in enumerate(dfAllData.groupby(['Make', 'Model'], sort=False)):
+            checkpoint.writeMakeModel(makeModelIndex, make, model, dfIter, [])
+    return checkpoint
+
+
+def measure(write):
+    tracemalloc.start()
+    start = time.perf_counter()
+    write()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, elapsed
+
+
+def benchmarkStreamingOutput():
+    print("Listings   Whole df: peak (MB)   time (s)   |   Streamed: peak (MB)   time (s)")
+    with tempfile.TemporaryDirectory() as scratch:
+        for rows in ROW_COUNTS:
+            checkpoint = fillCheckpoint(os.path.join(scratch, "checkpoint" + str(rows) + ".db"), rows)
+            outPaths = dict(pklOut=None, csvOut=os.path.join(scratch, "out.csv"),
+                            parquetOut=os.path.join(scratch, "out.parquet"), sqliteOut=os.path.join(scratch, "out.db"))
+            wholePeak, wholeTime = measure(lambda: writeOutput([checkpoint.loadAll()], openSinks(SINKS, **outPaths)))
+            streamPeak, streamTime = measure(lambda: writeOutput(checkpoint.iterBatches(OUTPUT_BATCH_SIZE), openSinks(SINKS, **outPaths)))
+            checkpoint.close()
+            print("%8d   %18.1f   %8.2f   |   %18.1f   %8.2f" % (rows, wholePeak / 1e6, wholeTime, streamPeak / 1e6, streamTime))
+
+
+if __name__ == "__main__":
+    benchmarkStreamingOutput()
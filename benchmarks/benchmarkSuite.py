@@ -0,0 +1,321 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+try:
+    import resource
+except ImportError: # Not on Windows - peak memory is left out of the report there
+    resource = None
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.join(BENCHMARK_DIR, "..")
+sys.path.insert(0, REPO_DIR)
+import pandas as pd
+import autoTraderUsedCarScrape
+import autoTraderScrapeMakesModels
+from autoTraderMetrics import metrics, configureLogging
+from mockAutoTraderServer import MockAutoTraderServer, loadCatalogue, FIXTURE_DIR
+
+'''
+Offline benchmark suite - end to end runs of both scrapers against a local mock of the
+website (mockAutoTraderServer.py), and micro benchmarks of the stages within them, written
+to one JSON report so two versions of the code can be compared.
+
+    scrapeEndToEnd        performUsedCarWebScrape over MAKE_MODELS make/models of
+                          PAGINATION_DEPTH pages, with LATENCY on every response and
+                          ERROR_RATE of requests failing - pages and listings per second
+    makesModelsEndToEnd   performMakeModelWebScrape over the same catalogue's options JSON
+    fetchPages            scrapePage over FETCH_PAGES pages of one make/model with no latency -
+                          the cost of the fetching itself
+    parsePage             parsePage over the saved search pages in benchmarks/fixtures
+    extractAttributes     extractAttributes and dfGoodFormat over PARSE_PAGES parsed pages
+    bokehCallbacks        latency of the bokeh app's callbacks as the selection is changed,
+                          over a synthetic dataset of BOKEH_ROWS listings (needs bokeh installed)
+
+Every case runs in a process of its own, so each one's peak memory (max RSS) is its own.
+The fastest of REPEATS runs is kept for the micro benchmarks.
+
+Run the suite, writing a report named after the current commit:
+
+python benchmarks/benchmarkSuite.py
+
+Run it and compare against an earlier report, or compare two reports - any metric more than
+REGRESSION_THRESHOLD worse is flagged and the exit code is 1:
+
+python benchmarks/benchmarkSuite.py --baseline benchmarkReport.1a2b3c4.json
+python benchmarks/benchmarkSuite.py --compare benchmarkReport.1a2b3c4.json benchmarkReport.5d6e7f8.json
+'''
+
+MAKE_MODELS = 20
+PAGINATION_DEPTH = 5
+LATENCY = 0.02 # Seconds added to every mock response in the end to end runs
+ERROR_RATE = 0.01 # Share of mock requests answered with a 503 in the end to end runs
+FETCH_PAGES = 30
+PARSE_PAGES = 500
+BOKEH_ROWS = 200000
+REPEATS = 3
+REGRESSION_THRESHOLD = 0.10 # Flag metrics more than 10% worse than the baseline
+SEED = 0
+
+
+def peakMemoryMB(who):
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10 # Bytes on macOS, KB on Linux
+
+
+def bestTime(function):
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def loadPages(count):
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.html"))):
+        with open(path, "rb") as f:
+            fixtures.append(f.read())
+    return [fixtures[i % len(fixtures)] for i in range(count)]
+
+
+def benchScrapeEndToEnd():
+    mock = MockAutoTraderServer(latency=LATENCY, errorRate=ERROR_RATE, paginationDepth=PAGINATION_DEPTH,
+                                catalogue=loadCatalogue(MAKE_MODELS), seed=SEED).start()
+    pd.DataFrame(mock.catalogue, columns=["Make", "Model"]).to_pickle("makeModels.pkl")
+    autoTraderUsedCarScrape.AUTOTRADER_URL = mock.url
+    autoTraderUsedCarScrape.PKL_READ_FILE = "makeModels.pkl"
+    autoTraderUsedCarScrape.MAX_REQUESTS_PER_SECOND = None # Measure the scraper, not the rate cap
+    autoTraderUsedCarScrape.RESPONSE_CACHE = False
+
+    start = time.perf_counter()
+    autoTraderUsedCarScrape.performUsedCarWebScrape()
+    elapsed = time.perf_counter() - start
+    mock.stop()
+    return {"seconds": elapsed,
+            "pagesPerSecond": metrics.total("pages_total") / elapsed,
+            "listingsPerSecond": metrics.total("listings_total") / elapsed,
+            "requests": mock.requests,
+            "listings": metrics.total("listings_total")}
+
+
+def benchMakesModelsEndToEnd():
+    mock = MockAutoTraderServer(latency=LATENCY, errorRate=ERROR_RATE, catalogue=loadCatalogue(MAKE_MODELS), seed=SEED).start()
+    autoTraderScrapeMakesModels.AUTOTRADER_URL = mock.url
+    autoTraderScrapeMakesModels.MAX_REQUESTS_PER_SECOND = None
+    autoTraderScrapeMakesModels.OPTIONS_CACHE_FILE = None
+
+    start = time.perf_counter()
+    autoTraderScrapeMakesModels.performMakeModelWebScrape()
+    elapsed = time.perf_counter() - start
+    mock.stop()
+    makeModels = pd.read_pickle(autoTraderScrapeMakesModels.OUTPUT_PKL_FILE).shape[0]
+    if makeModels != MAKE_MODELS:
+        raise AssertionError("Found " + str(makeModels) + " make/models, the mock has " + str(MAKE_MODELS))
+    return {"seconds": elapsed, "requestsPerSecond": mock.requests / elapsed}
+
+
+def benchFetchPages():
+    mock = MockAutoTraderServer(paginationDepth=FETCH_PAGES, catalogue=loadCatalogue(1)).start()
+    make, model = mock.catalogue[0]
+    autoTraderUsedCarScrape.AUTOTRADER_URL = mock.url
+    autoTraderUsedCarScrape.MAX_REQUESTS_PER_SECOND = None
+    webScraper = autoTraderUsedCarScrape.AutoTraderUsedCarScraper(None, None, None)
+    webScraper.adaptivePagination = False
+    urlSet = webScraper.urlPages(webScraper.urlModelCreate(make, model), FETCH_PAGES)
+    elapsed = bestTime(lambda: webScraper.scrapePage(urlSet, (0,), make, model))
+    webScraper.session.close()
+    mock.stop()
+    return {"pagesPerSecond": FETCH_PAGES / elapsed}
+
+
+def benchParsePage():
+    pages = loadPages(PARSE_PAGES)
+    webScraper = autoTraderUsedCarScrape.AutoTraderUsedCarScraper(None, None, None)
+    elapsed = bestTime(lambda: [webScraper.parsePage(page) for page in pages])
+    listings = sum(len(webScraper.parsePage(page)[0]['Name']) for page in pages)
+    return {"pagesPerSecond": PARSE_PAGES / elapsed, "listingsPerSecond": listings / elapsed}
+
+
+def benchExtractAttributes():
+    webScraper = autoTraderUsedCarScrape.AutoTraderUsedCarScraper(None, None, None)
+    pageSet = [webScraper.parsePage(page)[0] for page in loadPages(PARSE_PAGES)]
+    listings = sum(len(pageColumns['Name']) for pageColumns in pageSet)
+    elapsed = bestTime(lambda: webScraper.dfGoodFormat(webScraper.extractAttributes(pageSet), "Audi", "A4"))
+    return {"listingsPerSecond": listings / elapsed}
+
+
+'''
+Build the bokeh app's document the way bokeh serve does for each new session, then time
+each callback as the selection is changed - including going back to a selection already
+plotted, which is served from the app's cache
+'''
+def benchBokehCallbacks():
+    try:
+        from bokeh.application import Application
+        from bokeh.application.handlers.script import ScriptHandler
+    except ImportError:
+        return {"skipped": "bokeh is not installed"}
+    from benchmarkOutputStore import makeDataset
+    from autoTraderOutputStore import SqliteSink, SQLITE_OUT_FILE # DATA_FILE of bokehServerAutoTrader.py
+    sink = SqliteSink(SQLITE_OUT_FILE)
+    sink.write(makeDataset(BOKEH_ROWS))
+    sink.close()
+
+    start = time.perf_counter()
+    document = Application(ScriptHandler(filename=os.path.join(REPO_DIR, "bokehServerAutoTrader.py"))).create_document()
+    sessionStart = time.perf_counter() - start
+    make = document.select_one({"title": "Select Car Make"})
+    model = document.select_one({"title": "Select Car Model"})
+    changes = [(make, make.options[1]), (model, model.options[1]), (document.select_one({"title": "X-Axis"}), "Year"),
+               (document.select_one({"title": "Y-Axis"}), "Miles"), (document.select_one({"title": "Size"}), "None"),
+               (document.select_one({"title": "Color"}), "Price"), (make, make.options[0]), (make, make.options[1])]
+    latencies = []
+    for widget, value in changes:
+        start = time.perf_counter()
+        widget.value = value # Runs the widget's on_change callbacks
+        latencies.append(time.perf_counter() - start)
+    return {"sessionStartMs": sessionStart * 1e3,
+            "callbackMeanMs": sum(latencies) / len(latencies) * 1e3,
+            "callbackMaxMs": max(latencies) * 1e3}
+
+
+CASES = {"scrapeEndToEnd": benchScrapeEndToEnd,
+         "makesModelsEndToEnd": benchMakesModelsEndToEnd,
+         "fetchPages": benchFetchPages,
+         "parsePage": benchParsePage,
+         "extractAttributes": benchExtractAttributes,
+         "bokehCallbacks": benchBokehCallbacks}
+
+
+'''
+Run one case in this process, from a scratch directory, and print its results as JSON
+'''
+def runCase(name):
+    random.seed(SEED) # Retry backoff jitter
+    configureLogging("WARNING")
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            results = CASES[name]()
+        finally:
+            os.chdir(BENCHMARK_DIR) # Out of the scratch directory so it can be removed
+    if "skipped" not in results:
+        results["peakMemoryMB"] = peakMemoryMB(resource.RUSAGE_SELF) if resource is not None else None
+        workerPeak = peakMemoryMB(resource.RUSAGE_CHILDREN) if resource is not None else None
+        if workerPeak:
+            results["workerPeakMemoryMB"] = workerPeak # Largest parse worker process
+        results = {metric: value for metric, value in results.items() if value is not None}
+    print(json.dumps(results))
+
+
+def gitVersion():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+'''
+Run every case, each in a fresh process, and write the report to outPath
+'''
+def runSuite(outPath, cases):
+    report = {"version": gitVersion(),
+              "createdAt": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+              "settings": {"MAKE_MODELS": MAKE_MODELS, "PAGINATION_DEPTH": PAGINATION_DEPTH, "LATENCY": LATENCY,
+                           "ERROR_RATE": ERROR_RATE, "FETCH_PAGES": FETCH_PAGES, "PARSE_PAGES": PARSE_PAGES,
+                           "BOKEH_ROWS": BOKEH_ROWS, "REPEATS": REPEATS,
+                           "PARSE_WORKERS": autoTraderUsedCarScrape.PARSE_WORKERS,
+                           "PARSER_BACKEND": autoTraderUsedCarScrape.PARSER_BACKEND},
+              "results": {}}
+    for name in cases:
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", name],
+                               capture_output=True, text=True)
+        if child.returncode != 0:
+            raise RuntimeError(name + " failed:\n" + child.stderr)
+        report["results"][name] = json.loads(child.stdout.strip().splitlines()[-1])
+        print("%-20s %s" % (name, ", ".join(metric + " " + formatValue(value) for metric, value in report["results"][name].items())))
+
+    outPath = outPath or "benchmarkReport." + report["version"] + ".json"
+    with open(outPath, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Report written to " + outPath)
+    return report
+
+
+def formatValue(value):
+    return "%.2f" % value if isinstance(value, float) else str(value)
+
+
+'''
+1 if a metric is better higher (...PerSecond), -1 if better lower (seconds, ...Ms, ...MB),
+0 for counts that are only there for reference
+'''
+def betterDirection(metric):
+    if metric.endswith("PerSecond"):
+        return 1
+    if metric == "seconds" or metric.endswith("Ms") or metric.endswith("MB"):
+        return -1
+    return 0
+
+
+'''
+Print every metric of report against baseline. Returns the number of metrics more than
+REGRESSION_THRESHOLD worse.
+'''
+def compareReports(baseline, report):
+    if baseline["machine"] != report["machine"] or baseline["settings"] != report["settings"]:
+        print("Note: the reports were made on different machines or with different settings")
+    print("%-20s %-22s %12s %12s %9s" % ("Case", "Metric", baseline["version"][:12], report["version"][:12], "Change"))
+    regressions = 0
+    for name, results in report["results"].items():
+        for metric, value in results.items():
+            old = baseline["results"].get(name, {}).get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or old == 0:
+                continue
+            change = (value - old) / old
+            flag = ""
+            if -change * betterDirection(metric) > REGRESSION_THRESHOLD:
+                flag = "  REGRESSION"
+                regressions = regressions + 1
+            print("%-20s %-22s %12s %12s %+8.1f%%%s" % (name, metric, formatValue(old), formatValue(value), change * 100, flag))
+    print(str(regressions) + " regressions over " + str(int(REGRESSION_THRESHOLD * 100)) + "%")
+    return regressions
+
+
+def loadReport(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Offline benchmarks of the scrapers and the bokeh app")
+    argParser.add_argument("--out", default=None, help="report path (default benchmarkReport.<commit>.json)")
+    argParser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES), help="cases to run (default all)")
+    argParser.add_argument("--baseline", default=None, help="report to compare this run against")
+    argParser.add_argument("--compare", nargs=2, metavar=("BASELINE", "REPORT"), help="only compare two reports")
+    argParser.add_argument("--case", choices=list(CASES), help=argparse.SUPPRESS) # Run one case - used by the suite itself
+    args = argParser.parse_args()
+    if args.case:
+        runCase(args.case)
+    elif args.compare:
+        sys.exit(1 if compareReports(loadReport(args.compare[0]), loadReport(args.compare[1])) else 0)
+    else:
+        report = runSuite(args.out, args.cases)
+        if args.baseline:
+            sys.exit(1 if compareReports(loadReport(args.baseline), report) else 0)
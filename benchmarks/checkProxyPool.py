@@ -0,0 +1,153 @@
+import contextlib
+import http.server
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import urllib.request
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from autoTraderUsedCarScrape import AutoTraderUsedCarScraper
+from autoTraderProxyPool import ROTATE_PER_REQUEST, ROTATE_PER_MAKE_MODEL
+import autoTraderUsedCarScrape
+from autoTraderFixtures import makeSearchPage
+from autoTraderMetrics import configureLogging
+
+'''
+Check the proxy pool (autoTraderProxyPool.py) against local stand-in proxies, in front of a
+local stand-in for the website serving generated search pages.
+
+STAND_IN_PROXIES are two working proxies with different latencies, one whose IP the
+website blocks (every request through it gets a 403) and one that is down (nothing
+listening). Every make/model is scraped through the pool with each rotation, and the check
+is that every page still comes back, giving the same df as scraping without proxies - the
+requests that went to the blocked and dead proxies retried through the working ones. The
+pool's per proxy stats are logged for each rotation, along with any quarantines and evictions.
+
+To run from the repo root:
+
+python benchmarks/checkProxyPool.py
+'''
+
+MAKE_MODELS = [("Audi", "A4"), ("BMW", "X5"), ("Ford", "Focus"), ("Kia", "Ceed"), ("Volvo", "XC90")]
+PAGES_PER_MAKE_MODEL = 3
+STAND_IN_PROXIES = [("good", 0.01), ("good", 0.05), ("blocked", 0.0), ("dead", 0.0)] # (behaviour, latency)
+
+
+class WebsiteHandler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            page = makeSearchPage(int(query['page'][0]), seed=len(query['model'][0]),
+                                  totalResults=PAGES_PER_MAKE_MODEL * 12,
+                                  make=query['make'][0], model=query['model'][0]).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+
+        def log_message(self, *args):
+            pass
+
+
+'''
+Forward proxy for plain http - the request line holds the full url to fetch
+'''
+class ProxyHandler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            behaviour, latency = self.server.standIn
+            if behaviour == "blocked":
+                body = b"Forbidden"
+                self.send_response(403)
+            else:
+                time.sleep(latency)
+                opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+                with opener.open(self.path) as response:
+                    body = response.read()
+                self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+        def log_message(self, *args):
+            pass
+
+
+def startServer(handler, standIn=None):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.standIn = standIn
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def deadProxyPort():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1] # Closed again, so nothing is listening on it
+
+
+'''
+Only log warnings - e.g. proxies quarantined - while scraping, not every make/model
+'''
+@contextlib.contextmanager
+def warningsOnly():
+    logging.disable(logging.INFO)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def scrapeAll(webScraper, websitePort):
+    pageSet = []
+    problemRows = []
+    for i, (make, model) in enumerate(MAKE_MODELS):
+        fullURL = "http://127.0.0.1:" + str(websitePort) + "/car-search?make=" + make + "&model=" + model + "&page="
+        pages, problems = webScraper.scrapePage(webScraper.urlPages(fullURL, PAGES_PER_MAKE_MODEL), (i,), make, model)
+        pageSet.extend(pages)
+        problemRows.extend(problems)
+    return webScraper.extractAttributes(pageSet), problemRows
+
+
+def checkProxyPool():
+    website = startServer(WebsiteHandler)
+    proxies = []
+    for behaviour, latency in STAND_IN_PROXIES:
+        if behaviour == "dead":
+            proxies.append("http://127.0.0.1:" + str(deadProxyPort()))
+        else:
+            proxies.append("http://127.0.0.1:" + str(startServer(ProxyHandler, (behaviour, latency)).server_port))
+
+    with warningsOnly():
+        dfDirect, problemRows = scrapeAll(AutoTraderUsedCarScraper(None, None, None), website.server_port)
+
+    for rotation in [ROTATE_PER_REQUEST, ROTATE_PER_MAKE_MODEL]:
+        autoTraderUsedCarScrape.PROXY_ROTATION = rotation
+        webScraper = AutoTraderUsedCarScraper(proxies, None, None)
+        webScraper.session.backoffBase = 0.05
+        with warningsOnly():
+            dfProxied, problemRows = scrapeAll(webScraper, website.server_port)
+        webScraper.session.close()
+
+        if problemRows:
+            raise AssertionError(str(len(problemRows)) + " pages failed through the pool with rotation " + rotation)
+        if not dfProxied.equals(dfDirect):
+            raise AssertionError("Scraping through the pool gave a different df with rotation " + rotation)
+        pool = webScraper.proxyPool
+        for proxy, (behaviour, latency) in zip(pool.proxies, STAND_IN_PROXIES):
+            if (behaviour == "good") != (proxy.failures == 0):
+                raise AssertionError(behaviour + " proxy " + proxy.name + " failed " + str(proxy.failures) + " requests")
+        print("Rotation: " + rotation + " - " + str(dfProxied.shape[0]) + " listings, same as without proxies")
+        pool.logStats()
+        print("")
+
+
+if __name__ == "__main__":
+    configureLogging()
+    checkProxyPool()
@@ -0,0 +1,207 @@
+import argparse
+import glob
+import hashlib
+import http.server
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from autoTraderFixtures import makeSearchPage, LISTINGS_PER_PAGE
+
+'''
+Local stand-in for the AutoTrader website, so the scrapers can be run and benchmarked
+offline. Point either scraper's AUTOTRADER_URL at it.
+
+Serves the two kinds of request the scrapers make:
+
+    /car-search?make=...&model=...&page=N - a search result page
+    /json/search/options?...[&make=...]   - the options JSON of every make, or of one make's models
+
+Search pages are the saved pages in benchmarks/fixtures ("recorded"), cycled through for each
+page number, or synthetic pages from autoTraderFixtures.py ("generated"). Either way every
+make/model has paginationDepth pages - the result count and pagination are rewritten to say
+so - and asking for a page past the last gets the last page again, as the website does.
+Advert IDs are rewritten to be unique to each make/model and page.
+
+latency is added to every response, and errorRate of requests are answered with a 503 that
+the session retries. The options JSON has an ETag, so the makes scraper's options cache
+gets "304 Not Modified" back when it asks again. The random errors are seeded, so the same
+settings fail the same share of requests on every run.
+
+To run on its own, e.g. to point the scrapers at by hand:
+
+python benchmarks/mockAutoTraderServer.py --port 8080 --latency 0.05 --error-rate 0.02 --pages 5
+'''
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+MAKE_MODEL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "autoTraderMakeAndModel.pkl")
+RECORDED = "recorded"
+GENERATED = "generated"
+LATENCY = 0.0 # Seconds added to every response
+ERROR_RATE = 0.0 # Share of requests answered with a 503
+PAGINATION_DEPTH = 5 # Pages of results every make/model has
+MAKE_MODELS = 20 # Make/models in the catalogue - the first of autoTraderMakeAndModel.pkl
+ADVERT_ID_PATTERN = re.compile(r'(id="|/car-details/)(\d{12,})')
+
+
+'''
+The first count make/models of the scraper's make and model pkl, as (make, model) pairs
+'''
+def loadCatalogue(count=MAKE_MODELS):
+    import pandas as pd
+    dfMakeModel = pd.read_pickle(MAKE_MODEL_FILE)
+    return [(row.iloc[0], row.iloc[1]) for index, row in dfMakeModel.iloc[:count].iterrows()]
+
+
+def loadRecordedPages():
+    pages = []
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.html"))):
+        with open(path, "r", encoding="utf-8") as f:
+            pages.append(f.read())
+    return pages
+
+
+class MockAutoTraderHandler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            mock = self.server.mock
+            if mock.latency:
+                time.sleep(mock.latency)
+            if mock.failNext():
+                self.sendBody(503, b"Service Unavailable", "text/plain")
+                return
+
+            url = urlparse(self.path)
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+            if url.path == "/car-search":
+                body = mock.searchPage(query.get("make", ""), query.get("model", ""), int(query.get("page", "1")))
+                self.sendBody(200, body.encode(), "text/html; charset=utf-8")
+            elif url.path == "/json/search/options":
+                body = mock.optionsJson(query.get("make"))
+                if body is None:
+                    self.sendBody(404, b"Not Found", "text/plain")
+                    return
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.sendBody(200, body, "application/json", etag)
+            else:
+                self.sendBody(404, b"Not Found", "text/plain")
+
+
+        def sendBody(self, status, body, contentType, etag=None):
+            self.send_response(status)
+            self.send_header("Content-Type", contentType)
+            self.send_header("Content-Length", str(len(body)))
+            if etag is not None:
+                self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+
+        def log_message(self, *args):
+            pass
+
+
+class MockAutoTraderServer():
+
+        def __init__(self, port=0, latency=LATENCY, errorRate=ERROR_RATE, paginationDepth=PAGINATION_DEPTH,
+                     pageSource=RECORDED, catalogue=None, seed=0):
+            self.latency = latency
+            self.errorRate = errorRate
+            self.paginationDepth = paginationDepth
+            self.pageSource = pageSource
+            self.catalogue = catalogue if catalogue is not None else loadCatalogue()
+            self.recordedPages = loadRecordedPages() if pageSource == RECORDED else None
+            self.makeModelIndexes = {(make.upper(), model.upper()): i for i, (make, model) in enumerate(self.catalogue)}
+            self.lock = threading.Lock() # Handlers run on a thread per request
+            self.rng = random.Random(seed)
+            self.requests = 0
+            self.errors = 0
+            self.server = http.server.ThreadingHTTPServer(("127.0.0.1", port), MockAutoTraderHandler)
+            self.server.daemon_threads = True
+            self.server.mock = self
+            self.url = "http://127.0.0.1:" + str(self.server.server_port)
+            self.thread = None
+
+
+        def start(self):
+            self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+            self.thread.start()
+            return self
+
+
+        def stop(self):
+            self.server.shutdown()
+            self.server.server_close()
+
+
+        def failNext(self):
+            with self.lock:
+                self.requests = self.requests + 1
+                fail = self.errorRate > 0 and self.rng.random() < self.errorRate
+                self.errors = self.errors + (1 if fail else 0)
+            return fail
+
+
+        '''
+        Page pageNum of a make/model's search results. The scraper upper cases the make and
+        model, so they are matched whatever the case.
+        '''
+        def searchPage(self, make, model, pageNum):
+            makeModelIndex = self.makeModelIndexes.get((make.upper(), model.upper()), len(self.catalogue))
+            pageNum = max(1, min(pageNum, self.paginationDepth))
+            totalResults = self.paginationDepth * LISTINGS_PER_PAGE
+            if self.pageSource == GENERATED:
+                return makeSearchPage(pageNum, seed=makeModelIndex, totalResults=totalResults, make=make, model=model)
+
+            page = self.recordedPages[(pageNum - 1) % len(self.recordedPages)]
+            page = re.sub(r"<title>Used .*? for sale", "<title>Used " + make + " " + model + " for sale", page, count=1)
+            page = re.sub(r"[\d,]+ cars found", "{:,}".format(totalResults) + " cars found", page, count=1)
+            page = re.sub(r"Page <strong>\d+</strong> of <strong>\d+</strong>",
+                          "Page <strong>" + str(pageNum) + "</strong> of <strong>" + str(self.paginationDepth) + "</strong>", page, count=1)
+            advertIds = {}
+            def uniqueAdvertId(match):
+                if match.group(2) not in advertIds:
+                    advertIds[match.group(2)] = str(300000000000000 + makeModelIndex * 100000 + pageNum * 100 + len(advertIds))
+                return match.group(1) + advertIds[match.group(2)]
+            return ADVERT_ID_PATTERN.sub(uniqueAdvertId, page)
+
+
+        '''
+        Options JSON bytes listing every make, or the models of make - None for an unknown make
+        '''
+        def optionsJson(self, make=None):
+            if make is None:
+                makes = list(dict.fromkeys(make for make, model in self.catalogue))
+                return json.dumps({"options": {"make": [{"displayName": make} for make in makes]}}).encode()
+            models = [model for catalogueMake, model in self.catalogue if catalogueMake.upper() == make.upper()]
+            if not models:
+                return None
+            return json.dumps({"options": {"model": [{"displayName": model} for model in models]}}).encode()
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Serve recorded AutoTrader pages and options JSON locally")
+    argParser.add_argument("--port", type=int, default=8080)
+    argParser.add_argument("--latency", type=float, default=LATENCY, help="seconds added to every response")
+    argParser.add_argument("--error-rate", type=float, default=ERROR_RATE, help="share of requests answered with a 503")
+    argParser.add_argument("--pages", type=int, default=PAGINATION_DEPTH, help="pages of results every make/model has")
+    argParser.add_argument("--make-models", type=int, default=MAKE_MODELS, help="make/models in the catalogue")
+    argParser.add_argument("--source", choices=[RECORDED, GENERATED], default=RECORDED, help="saved or synthetic search pages")
+    args = argParser.parse_args()
+    mock = MockAutoTraderServer(args.port, args.latency, args.error_rate, args.pages, args.source, loadCatalogue(args.make_models))
+    print("Serving on " + mock.url + " - set AUTOTRADER_URL to it in the scrapers. Ctrl+C to stop")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        mock.server.server_close()
@@ -1,118 +1,214 @@
+import logging
+from functools import lru_cache
+import numpy as np
 import pandas as pd
-from bokeh.layouts import row, widgetbox
+from bokeh.events import Reset
+from bokeh.layouts import column, row
 from bokeh.models import Select
 from bokeh.palettes import Category20c
 from bokeh.plotting import curdoc, figure
 from bokeh.models import  HoverTool
 from bokeh.models import ColumnDataSource
+from autoTraderDataLayer import loadDataset
+from autoTraderLevelOfDetail import levelOfDetail, inWindow, emptyDensity
+from autoTraderOutputStore import SQLITE_OUT_FILE
+from autoTraderStatsCube import loadStatsCube, STATS_CUBE_FILE
 
 """
 To run within CMD:
     
 bokeh serve --show bokehServerAutoTrader.py
 
+DATA_FILE is the SQLite output of the used car web scrape (usedCarAutoTraderOutput.db) by
+default. It can also be a pkl, or the Parquet dataset directory (usedCarAutoTraderOutput.parquet).
+It is opened once per server process and shared by every session - see autoTraderDataLayer.py.
+
+Selections with more than LOD_THRESHOLD points in view are shown as a binned density rather
+than individual points, until zoomed in - see autoTraderLevelOfDetail.py.
+
+If the statistics cube STATS_FILE has been built (see autoTraderStatsCube.py), plots of Price
+against Year show the median price of each year with its interquartile range, and plots of
+Price against Miles the price per mile trend line. The title gives the selection's median
+price and depreciation. These come from the cube, not from the selection's rows.
 """
-DATA_FILE = "dataFullDatasetAutoTraderPickle.pkl"
+DATA_FILE = SQLITE_OUT_FILE
+STATS_FILE = STATS_CUBE_FILE # Statistics cube overlaid on the plot - not shown if it hasn't been built
 SIZES = list(range(10, 30, 3))
 COLORS = Category20c[20] + Category20c[20] + Category20c[20]
 N_SIZES = len(SIZES)
 N_COLORS = len(COLORS)
+CACHE_SIZE = 256 # Prepared plots kept for repeat selections
+LOD_DELAY_MS = 250 # Wait for panning/zooming to settle before sending the detail for the new view
+
+logger = logging.getLogger(__name__)
+
+# Read in data - already loaded if another session has started in this process. Each
+# make/model's rows are one contiguous block of the dataset, so filtering is a slice rather
+# than two scans of the full dataset
+dataset = loadDataset(DATA_FILE)
 
-# Read in data
-dfOnline = pd.read_pickle(DATA_FILE)
-
-# Create ordered dict of makes and models for dynamic drop down box
-makeModelDict = dfOnline.groupby('Make')['Model'].apply(list).to_dict()
-makeModelDictSorted =  {k:sorted(set(j),key=j.index) for k,j in makeModelDict.items()}
-
-# Prep values for plotting
-dfOnline.Price = dfOnline.Price.astype(float)
-dfOnline.Year = dfOnline.Year.astype(float)
-dfOnline.Miles = dfOnline.Miles.astype(float)
-dfOnline.BHP = dfOnline.BHP.astype(float)
-dfOnline.L = dfOnline.L.astype(float)
-columns = sorted(dfOnline.columns)
-discrete = [x for x in columns if dfOnline[x].dtype == object]
+# Statistics cube - also opened once per process, None if there isn't one
+statsCube = loadStatsCube(STATS_FILE)
+
+# Ordered dict of makes and models for dynamic drop down box
+makeModelDictSorted = dataset.makeModels
+
+# Values for plotting
+columns = dataset.columns
+discrete = dataset.discrete # object, string or category
 continuous = [x for x in columns if x not in discrete]
 
-def create_figure():
-    # Print to console/CMD what you have requested
-    print("X VALUE: " + x.value)
-    print("Y VALUE: " + y.value)
-    print("Make VALUE: " + make.value)
-    print("Model VALUE: " + model.value)
-
-    # Slice df to request
-    dfFilteredMake = dfOnline[dfOnline["Make"] == make.value]
-    dfFilteredModel = dfFilteredMake[dfFilteredMake["Model"] == model.value]
+
+@lru_cache(maxsize=CACHE_SIZE)
+def getMakeModelRows(makeValue, modelValue):
+    return dataset.rows(makeValue, modelValue)
+
+
+# Group number of each listing for the size or color of its point - quantiles of the column
+# if it has more than N_SIZES values, otherwise one group per value
+@lru_cache(maxsize=CACHE_SIZE)
+def getGroupCodes(makeValue, modelValue, column, nGroups):
+    values = getMakeModelRows(makeValue, modelValue)[column]
+    if len(set(values)) > N_SIZES:
+        groups = pd.qcut(values.values, nGroups, duplicates='drop')
+    else:
+        groups = pd.Categorical(values)
+    return groups.codes
+
+
+# Everything plotted for one selection - the data source columns and the ranges of any
+# discrete axes. Cached, so picking a selection again skips straight to drawing it.
+@lru_cache(maxsize=CACHE_SIZE)
+def prepareFigureData(makeValue, modelValue, xValue, yValue, sizeValue, colorValue):
+    dfFilteredModel = getMakeModelRows(makeValue, modelValue)
+    
+    # Get requested values
+    xs = dfFilteredModel[xValue].to_numpy()
+    ys = dfFilteredModel[yValue].to_numpy()
+    xRange = sorted(set(xs)) if xValue in discrete else None
+    yRange = sorted(set(ys)) if yValue in discrete else None
+    
+    # Assign size attribute to plot - a full column either way so the data source can be swapped in place
+    sz = np.full(len(dfFilteredModel), 50)
+    if sizeValue != 'None':
+        sz = np.array(SIZES)[getGroupCodes(makeValue, modelValue, sizeValue, N_SIZES)]
     
-    # Get requested values and names
-    xs = dfFilteredModel[x.value].values
-    ys = dfFilteredModel[y.value].values
+    # Assign color attribute to plot
+    c = np.full(len(dfFilteredModel), "#31AADE", dtype=object)
+    if colorValue != 'None':
+        c = np.array(COLORS)[getGroupCodes(makeValue, modelValue, colorValue, N_COLORS)]
+    
+    # Data source including hover over source args
+    data = dict(x=xs,
+                y=ys,
+                color=c,
+                size=sz,
+                argName=dfFilteredModel.Name.to_numpy(),
+                argPrice=dfFilteredModel.Price.to_numpy(),
+                argYear=dfFilteredModel.Year.to_numpy(),
+                argMiles=dfFilteredModel.Miles.to_numpy(),
+                argBHP=dfFilteredModel.BHP.to_numpy(),
+                argL=dfFilteredModel.L.to_numpy(),
+                argTrans=dfFilteredModel.Trans.to_numpy())
+    return data, xRange, yRange
+
+
+def pounds(value):
+    return ("-" if value < 0 else "") + u"\u00a3" + "{:,.0f}".format(abs(value))
+
+
+# Overlay of the cube's statistics for one selection - the line and band to draw (empty for
+# axes there are no statistics of) and the text to add to the title
+@lru_cache(maxsize=CACHE_SIZE)
+def getOverlay(makeValue, modelValue, xValue, yValue):
+    overlay = dict(x=[], y=[], lower=[], upper=[])
+    if statsCube is None:
+        return overlay, ""
+    dfStats = statsCube.summary(['Make', 'Model'], make=makeValue, model=modelValue)
+    if dfStats.shape[0] == 0:
+        return overlay, ""
+    stats = dfStats.iloc[0]
+    caption = " - median " + pounds(stats.MedianPrice)
+    if stats.DepreciationPerYear == stats.DepreciationPerYear: # NAN with only one year
+        caption = caption + ", " + pounds(stats.DepreciationPerYear) + " per year newer"
+    if stats.PricePerMile == stats.PricePerMile:
+        caption = caption + ", " + pounds(1000 * stats.PricePerMile) + " per 1,000 miles"
+    
+    if yValue == 'Price' and xValue == 'Year':
+        dfYears = statsCube.summary(['Make', 'Model', 'Year'], make=makeValue, model=modelValue)
+        overlay = dict(x=dfYears.Year.to_numpy(dtype=float), y=dfYears.MedianPrice.to_numpy(),
+                       lower=dfYears.P25.to_numpy(), upper=dfYears.P75.to_numpy())
+    elif yValue == 'Price' and xValue == 'Miles' and stats.PricePerMile == stats.PricePerMile:
+        xs = np.array([stats.MinMiles, stats.MaxMiles])
+        ys = stats.MeanPrice + stats.PricePerMile * (xs - stats.MeanMiles)
+        overlay = dict(x=xs, y=ys, lower=ys, upper=ys)
+    return overlay, caption
+
+
+# The one data source plotted from - its data is replaced on each change rather than a new
+# figure being built, so only the new columns are sent to the browser
+source = ColumnDataSource(data=dict())
+densitySource = ColumnDataSource(data=emptyDensity()) # Bins shown instead of points for large selections
+statsSource = ColumnDataSource(data=dict(x=[], y=[], lower=[], upper=[])) # Statistics cube overlay
+plotAxisTypes = None # Whether the current figure's x and y axes are discrete
+plottedSelection = None
+viewWindow = None # (xStart, xEnd, yStart, yEnd) zoomed in to, None when showing everything
+refreshPending = False
+
+
+# Send the points, or the density if there are too many, for the selection's data within window
+def showDetail(data, window, discreteAxes):
+    points, density = levelOfDetail(data, window, discreteAxes=discreteAxes)
+    source.data = points
+    densitySource.data = density
+
+
+def create_figure():
+    global plotAxisTypes, plottedSelection, viewWindow
+
+    # Log what you have requested
+    logger.debug("X VALUE: %s", x.value)
+    logger.debug("Y VALUE: %s", y.value)
+    logger.debug("Make VALUE: %s", make.value)
+    logger.debug("Model VALUE: %s", model.value)
+
+    # Slice df to request, or reuse it if this selection has been plotted before
+    selection = (make.value, model.value, x.value, y.value, size.value, color.value)
+    data, xRange, yRange = prepareFigureData(*selection)
     x_title = x.value.title()
     y_title = y.value.title()
-
-    # Set Hoverover variables 
-    argName = dfFilteredModel.Name.values.tolist()
-    argPrice = dfFilteredModel.Price.values.tolist()
-    argYear = dfFilteredModel.Year.values.tolist()
-    argMiles = dfFilteredModel.Miles.values.tolist()
-    argBHP = dfFilteredModel.BHP.values.tolist()
-    argL = dfFilteredModel.L.values.tolist()
-    argTrans = dfFilteredModel.Trans.values.tolist()
+    viewWindow = None
+    showDetail(data, None, xRange is not None or yRange is not None)
+    overlay, caption = getOverlay(make.value, model.value, x.value, y.value)
+    statsSource.data = overlay
        
     # Set XY value and title
     kw = dict()
-    if x.value in discrete:
-        kw['x_range'] = sorted(set(xs))
-    if y.value in discrete:
-        kw['y_range'] = sorted(set(ys))
-    kw['title'] = "%s vs %s" % (x_title, y_title)
+    if xRange is not None:
+        kw['x_range'] = xRange
+    if yRange is not None:
+        kw['y_range'] = yRange
+    kw['title'] = "%s vs %s%s" % (x_title, y_title, caption)
 
     # Configure plot and labels
-    p = figure(plot_height=600, plot_width=800, tools='pan,box_zoom,hover,reset', **kw)
+    p = figure(height=600, width=800, tools='pan,box_zoom,hover,reset', **kw)
     p.xaxis.axis_label = x_title
     p.yaxis.axis_label = y_title
     
     # Orientate label
     if x.value in discrete:
-        p.xaxis.major_label_orientation = pd.np.pi / 4
-
-    # Assign size attribute to plot
-    sz = 50
-    if size.value != 'None':
-        if len(set(dfFilteredModel[size.value])) > N_SIZES:
-            groups = pd.qcut(dfFilteredModel[size.value].values, N_SIZES, duplicates='drop')
-        else:
-            groups = pd.Categorical(dfFilteredModel[size.value])
-        sz = [SIZES[xx] for xx in groups.codes]
-
-    # Assign color attribute to plot
-    c = "#31AADE"
-    if color.value != 'None':
-        if len(set(dfFilteredModel[color.value])) > N_SIZES:
-            groups = pd.qcut(dfFilteredModel[color.value].values, N_COLORS, duplicates='drop')
-        else:
-            groups = pd.Categorical(dfFilteredModel[color.value])
-        c = [COLORS[xx] for xx in groups.codes]
-        
-    # Data source including hover over source args
-    source = ColumnDataSource(data=dict(x=xs,
-                                        y=ys,
-                                        color=c,
-                                        size=sz,
-                                        argName=argName,
-                                        argPrice=argPrice,
-                                        argYear=argYear,
-                                        argMiles=argMiles,
-                                        argBHP=argBHP,
-                                        argL=argL,
-                                        argTrans=argTrans))
+        p.xaxis.major_label_orientation = np.pi / 4
 
     # Plot and set axis format
-    p.circle(x='x', y='y', color='color', size='size', source=source, line_color="white", alpha=0.6, hover_color='white', hover_alpha=0.5)
-    p.xaxis[0].formatter.use_scientific = False
-    p.yaxis[0].formatter.use_scientific = False
+    densityRenderer = p.rect(x='x', y='y', width='width', height='height', source=densitySource,
+                             fill_color="#31AADE", fill_alpha='alpha', line_color=None)
+    pointRenderer = p.scatter(x='x', y='y', marker='circle', color='color', size='size', source=source, line_color="white", alpha=0.6, hover_color='white', hover_alpha=0.5)
+    p.varea(x='x', y1='lower', y2='upper', source=statsSource, fill_color="#E6550D", fill_alpha=0.15)
+    p.line(x='x', y='y', source=statsSource, line_color="#E6550D", line_width=2)
+    if x.value not in discrete: # Categorical axes have no number format
+        p.xaxis[0].formatter.use_scientific = False
+    if y.value not in discrete:
+        p.yaxis[0].formatter.use_scientific = False
 
     # Define tooltips on hoverover
     hover = p.select(dict(type=HoverTool))
@@ -125,29 +221,107 @@ def create_figure():
                 ("Trans", "@argTrans")]
     hover.tooltips = TOOLTIPS
     hover.mode = "mouse"
-
+    hover.renderers = [pointRenderer]
+    p.add_tools(HoverTool(renderers=[densityRenderer], tooltips=[("Listings", "@count")]))
+    
+    # Swap between density and points as the view is zoomed
+    if xRange is None and yRange is None:
+        for axisRange in [p.x_range, p.y_range]:
+            axisRange.on_change('start', onRangeChange)
+            axisRange.on_change('end', onRangeChange)
+        p.on_event(Reset, onReset)
+
+    plotAxisTypes = (xRange is not None, yRange is not None)
+    plottedSelection = selection
     return p
 
 
+# Show the current selection on the existing figure - new data, axis factors, title and
+# labels. The glyphs stay as they are. Only if an axis switches between discrete and
+# continuous, which needs a different kind of range, or the figure is zoomed in, so its
+# ranges would not fit the new data, is a new figure built.
+def update_figure():
+    global plottedSelection
+    selection = (make.value, model.value, x.value, y.value, size.value, color.value)
+    if selection == plottedSelection: # e.g. the model change made by updateMake
+        return
+    data, xRange, yRange = prepareFigureData(*selection)
+    if (xRange is not None, yRange is not None) != plotAxisTypes or viewWindow is not None:
+        layout.children[1] = create_figure()
+        return
+    
+    # Log what you have requested
+    logger.debug("X VALUE: %s", x.value)
+    logger.debug("Y VALUE: %s", y.value)
+    logger.debug("Make VALUE: %s", make.value)
+    logger.debug("Model VALUE: %s", model.value)
+    
+    p = layout.children[1]
+    showDetail(data, None, xRange is not None or yRange is not None)
+    overlay, caption = getOverlay(make.value, model.value, x.value, y.value)
+    statsSource.data = overlay
+    if xRange is not None:
+        p.x_range.factors = xRange
+    if yRange is not None:
+        p.y_range.factors = yRange
+    x_title = x.value.title()
+    y_title = y.value.title()
+    p.title.text = "%s vs %s%s" % (x_title, y_title, caption)
+    p.xaxis.axis_label = x_title
+    p.yaxis.axis_label = y_title
+    plottedSelection = selection
+
+
+# Panning and zooming change the ranges many times a second - wait for it to settle
+def onRangeChange(attr, old, new):
+    global refreshPending
+    if not refreshPending:
+        refreshPending = True
+        curdoc().add_timeout_callback(refreshDetail, LOD_DELAY_MS)
+
+
+# Send the points or density for the part of the plot now in view
+def refreshDetail():
+    global refreshPending, viewWindow
+    refreshPending = False
+    p = layout.children[1]
+    window = (p.x_range.start, p.x_range.end, p.y_range.start, p.y_range.end)
+    if None in window:
+        return
+    data, xRange, yRange = prepareFigureData(*plottedSelection)
+    if viewWindow is None and inWindow(data['x'], data['y'], window).all():
+        return # Already showing everything
+    viewWindow = window
+    showDetail(data, window, False)
+
+
+# Reset tool - back to everything in the selection
+def onReset(event):
+    global viewWindow
+    viewWindow = None
+    data, xRange, yRange = prepareFigureData(*plottedSelection)
+    showDetail(data, None, False)
+
+
 def update(attr, old, new):
     makeVar = make.value
     model.options = makeModelDictSorted[makeVar]
-    layout.children[1] = create_figure()
+    update_figure()
 
 
 def updateMake(attr, old, new):
     makeVar = make.value
     model.options = makeModelDictSorted[makeVar]
     model.value = model.options[0]
-    print("UPDATE-MAKE: " + make.value + " " + model.value)
-    layout.children[1] = create_figure()
+    logger.debug("UPDATE-MAKE: %s %s", make.value, model.value)
+    update_figure()
 
 
 # Set initial values and then dictate how they react on updates/changes from user     
-make = Select(title='Select Car Make', value=sorted(dfOnline['Make'].unique())[0], options= sorted(dfOnline['Make'].unique()))
+make = Select(title='Select Car Make', value=dataset.makes[0], options= dataset.makes)
 make.on_change('value', updateMake)
 
-model = Select(title='Select Car Model', value=makeModelDictSorted[sorted(dfOnline['Make'].unique())[0]][0], options= makeModelDictSorted[sorted(dfOnline['Make'].unique())[0]] )
+model = Select(title='Select Car Model', value=makeModelDictSorted[dataset.makes[0]][0], options= makeModelDictSorted[dataset.makes[0]] )
 model.on_change('value', update)
 
 x = Select(title='X-Axis', value='Miles', options=columns)
@@ -164,18 +338,10 @@ color = Select(title='Color', value='Year', options=['None'] + continuous)
 color.on_change('value', update)
 
 # Define dynamic drop down box widgets
-controls = widgetbox([make, model, x, y, size, color], width=250)
+controls = column([make, model, x, y, size, color], width=250)
 
 #Set layout
 layout = row(controls, create_figure())
 
 curdoc().add_root(layout)
 curdoc().title = "Auto-Trader Dynamic Visualization"
-
-
-
-
-
-
-
-